@@ -0,0 +1,272 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from modules.fuzzy_defuzzifier import defuzzify_centroid
+from modules.fuzzy_exact_defuzzifier import infer_exact
+from modules.fuzzy_generate import generate_knowledge_base
+from modules.fuzzy_inference import infer_batch, infer_rules, map_variable_types
+from modules.fuzzy_load import KnowledgeBase, load_knowledge_base
+from modules.fuzzy_membership import create_membership_functions
+
+BUNDLED_FILES = ['tip.fuzzy', 'dv.fuzzy', 'anesthetics.fuzzy']
+SCALAR_ENGINES = ['custom', 'skfuzzy', 'skfuzzy_pooled']
+BATCH_ENGINES = ['batch', 'exact']
+CASE_KEYS = ['kb', 'engine', 'batch_size', 'resolution']
+
+
+def synthetic_knowledge_base(n_rules, seed=0):
+    '''
+    Generates a knowledge base of 4 antecedents with 5 terms each and rules of 1 to 3 premises (a fifth of them
+    joined with OR), for timing the engines at larger rule counts.
+
+        Args:
+            n_rules(int): number of rules
+            seed(int): seed of the generator (def: 0)
+
+        Returns:
+            kb(KnowledgeBase): the compiled knowledge base
+
+    '''
+
+
+    text, _ = generate_knowledge_base(n_variables=4, n_terms=5, n_rules=n_rules, n_premises=(1, 3), or_ratio=0.2,
+                                      seed=seed)
+    return KnowledgeBase(text, name='synthetic_{}_rules'.format(n_rules))
+
+
+class _Engine:
+    '''
+    Prepares one engine for a knowledge base and resolution, outside of the timed calls.
+    '''
+
+
+    def __init__(self, engine, kb, resolution):
+        self.engine = engine
+        self.kb = kb
+        self.tables = create_membership_functions(kb, resolution=resolution)
+        fuzzy_dict, x_ranges, var_names, fuzzy_variables = self.tables
+        if engine == 'custom':
+            self.vmfx_list, _ = map_variable_types(kb, fuzzy_variables, var_names, x_ranges, fuzzy_dict)
+        elif engine == 'skfuzzy':
+            from modules.fuzzy_control_system import map_variable_types as map_ctrl_types
+            self.vmfx_list, _ = map_ctrl_types(kb, fuzzy_variables, var_names, x_ranges, fuzzy_dict)
+        elif engine == 'skfuzzy_pooled':
+            from modules.fuzzy_control_system import FuzzyControlSystem
+            self.control_system = FuzzyControlSystem(kb, pool_size=1, flush_after_run=1)
+
+    def run(self, measurements):
+        fuzzy_dict, x_ranges, var_names, fuzzy_variables = self.tables
+        if self.engine == 'batch':
+            return infer_batch(self.kb, measurements, fuzzy_dict, x_ranges)[0]
+        elif self.engine == 'exact':
+            return infer_exact(self.kb, measurements)
+
+        results = []
+        for row in measurements:
+            fuzzy_measurements = dict(zip(self.kb.antecedents, row))
+            try:
+                if self.engine == 'custom':
+                    activation_dict = infer_rules(self.kb, fuzzy_variables, fuzzy_dict, fuzzy_measurements, x_ranges)
+                    results.append(defuzzify_centroid(activation_dict, self.vmfx_list)[0])
+                elif self.engine == 'skfuzzy':
+                    from modules.fuzzy_control_system import apply_rules, create_rule_control_system
+                    rcs = create_rule_control_system(self.kb, fuzzy_variables, var_names, self.vmfx_list)
+                    ctr_sys_sim, _ = apply_rules(rcs, fuzzy_measurements, var_names, self.vmfx_list)
+                    results.append(ctr_sys_sim.output[self.kb.consequents[-1]])
+                else:
+                    results.append(self.control_system.compute(fuzzy_measurements)[self.kb.consequents[-1]])
+            except (ValueError, AssertionError):
+                results.append(np.nan)
+        return np.array(results)
+
+
+def random_measurements(kb, n_rows, seed=0):
+    '''
+    Draws measurement rows uniformly over the term supports of every antecedent.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            n_rows(int): number of rows
+            seed(int): seed of the random rows (def: 0)
+
+        Returns:
+            measurements(np.array): (n_rows, n_antecedents) matrix in kb.antecedents order
+
+    '''
+
+
+    rng = np.random.RandomState(seed)
+    columns = []
+    for var_name in kb.antecedents:
+        params = kb.term_params[var_name]
+        columns.append(rng.uniform(np.min(params[:, 0] - params[:, 2]), np.max(params[:, 1] + params[:, 3]), n_rows))
+    return np.column_stack(columns)
+
+
+def benchmark_case(kb, engine, batch_size, resolution, min_time=0.5, min_calls=3, max_calls=1000, seed=0):
+    '''
+    Times repeated calls of one engine on fixed-size batches of random measurements.
+    The peak memory is measured with tracemalloc on one extra call, so it does not slow down the timed calls.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            engine(str): 'custom', 'skfuzzy', 'skfuzzy_pooled', 'batch' or 'exact'
+            batch_size(int): number of measurement rows per call
+            resolution(float): the universe resolution of the membership tables
+            min_time(float): minimum timed duration in seconds (def: 0.5)
+            min_calls(int): minimum number of timed calls (def: 3)
+            max_calls(int): maximum number of timed calls (def: 1000)
+            seed(int): seed of the random measurements (def: 0)
+
+        Returns:
+            result(dict): the case keys, throughput in rows per second, call latency percentiles in milliseconds,
+                peak memory in MB and the share of undefined outputs
+
+    '''
+
+
+    runner = _Engine(engine, kb, resolution)
+    measurements = random_measurements(kb, batch_size * 8, seed)
+    batches = [measurements[i * batch_size:(i + 1) * batch_size] for i in range(8)]
+    results = runner.run(batches[0])
+
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < max_calls and (len(latencies) < min_calls or time.perf_counter() - start < min_time):
+        batch = batches[len(latencies) % len(batches)]
+        call_start = time.perf_counter()
+        runner.run(batch)
+        latencies.append(time.perf_counter() - call_start)
+
+    tracemalloc.start()
+    runner.run(batches[0])
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies = np.array(latencies) * 1000.0
+    return {'kb': kb.name, 'engine': engine, 'batch_size': batch_size, 'resolution': resolution,
+            'calls': len(latencies), 'throughput': batch_size * len(latencies) / (np.sum(latencies) / 1000.0),
+            'latency_p50_ms': float(np.percentile(latencies, 50)),
+            'latency_p90_ms': float(np.percentile(latencies, 90)),
+            'latency_p99_ms': float(np.percentile(latencies, 99)),
+            'peak_memory_mb': peak_memory / 1e6,
+            'undefined_share': float(np.mean(np.isnan(results)))}
+
+
+def run_benchmarks(files=None, rule_counts=(10, 100, 1000), engines=None, batch_sizes=(1, 100, 1000),
+                   resolutions=(0.1, 0.01), min_time=0.5, max_scalar_rules=100, log=None):
+    '''
+    Runs the benchmark sweep over knowledge bases, engines, batch sizes and universe resolutions.
+    The per-row engines are only timed with single rows, and the exact engine, which needs no tables,
+    only at the first resolution.
+
+        Args:
+            files(list): knowledge base files (def: the bundled examples)
+            rule_counts(list): rule counts of the synthetic knowledge bases (def: (10, 100, 1000))
+            engines(list): engines to time (def: all)
+            batch_sizes(list): rows per call of the batch engines (def: (1, 100, 1000))
+            resolutions(list): universe resolutions (def: (0.1, 0.01))
+            min_time(float): minimum timed duration of every case in seconds (def: 0.5)
+            max_scalar_rules(int): largest rule count the per-row engines are timed on (def: 100)
+            log(file): stream for progress lines (def: None - silent)
+
+        Returns:
+            report(dict): 'meta' with the environment and 'results' with one entry per case
+
+    '''
+
+
+    if files is None:
+        files = BUNDLED_FILES
+    if engines is None:
+        engines = SCALAR_ENGINES + BATCH_ENGINES
+    knowledge_bases = [load_knowledge_base(file) for file in files]
+    knowledge_bases += [synthetic_knowledge_base(n_rules) for n_rules in rule_counts]
+
+    results = []
+    for kb in knowledge_bases:
+        for resolution_idx, resolution in enumerate(resolutions):
+            for engine in engines:
+                if engine in SCALAR_ENGINES:
+                    if len(kb.rules) > max_scalar_rules:
+                        continue
+                    engine_batch_sizes = [1]
+                else:
+                    if engine == 'exact' and resolution_idx > 0:
+                        continue
+                    engine_batch_sizes = batch_sizes
+                for batch_size in engine_batch_sizes:
+                    result = benchmark_case(kb, engine, batch_size, resolution, min_time)
+                    results.append(result)
+                    if log is not None:
+                        log.write('{kb:<24} {engine:<15} {batch_size:>6} {resolution:>6} {throughput:>12.1f} rows/s '
+                                  'p50 {latency_p50_ms:.3f} ms p99 {latency_p99_ms:.3f} ms '
+                                  'peak {peak_memory_mb:.2f} MB\n'.format(**result))
+                        log.flush()
+
+    meta = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def compare_reports(report, baseline, tolerance=0.2):
+    '''
+    Compares every case with a stored baseline report. The speed ratio is taken on the median call latency,
+    which is less sensitive to scheduling noise than the mean throughput.
+
+        Args:
+            report(dict): the current report, as returned by run_benchmarks
+            baseline(dict): the baseline report
+            tolerance(float): the allowed relative slowdown (def: 0.2)
+
+        Returns:
+            regressions(list): (case, current / baseline speed ratio) of the cases slower than the tolerance
+            comparisons(list): (case, ratio) of every case present in both reports
+
+    '''
+
+
+    baseline_results = {tuple(r[k] for k in CASE_KEYS): r for r in baseline['results']}
+    comparisons = []
+    for result in report['results']:
+        case = tuple(result[k] for k in CASE_KEYS)
+        if case in baseline_results:
+            comparisons.append((case, baseline_results[case]['latency_p50_ms'] / result['latency_p50_ms']))
+    regressions = [(case, ratio) for case, ratio in comparisons if ratio < 1.0 - tolerance]
+    return regressions, comparisons
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the inference engines')
+    parser.add_argument('--files', nargs='+', default=BUNDLED_FILES, help='knowledge base files')
+    parser.add_argument('--rules', nargs='*', type=int, default=[10, 100, 1000], help='synthetic rule counts')
+    parser.add_argument('--engines', nargs='+', default=SCALAR_ENGINES + BATCH_ENGINES, help='engines to time')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 100, 1000], help='rows per batch call')
+    parser.add_argument('--resolutions', nargs='+', type=float, default=[0.1, 0.01], help='universe resolutions')
+    parser.add_argument('--min-time', type=float, default=0.5, help='minimum seconds per case')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--compare', help='baseline JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.files, args.rules, args.engines, args.batch_sizes, args.resolutions, args.min_time,
+                            log=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            regressions, comparisons = compare_reports(report, json.load(fp), args.tolerance)
+        for case, ratio in comparisons:
+            sys.stderr.write('{:<70} {:6.2f}x{}\n'.format(str(case), ratio, '  REGRESSION' if ratio < 1.0 - args.tolerance
+                                                          else ''))
+        sys.exit(1 if regressions else 0)
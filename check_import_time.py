@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+
+# modules of the headless inference path and the packages they must not load at import time
+CORE_MODULES = ['modules.fuzzy_load', 'modules.fuzzy_membership', 'modules.fuzzy_defuzzifier',
+                'modules.fuzzy_inference', 'modules.fuzzy_exact_defuzzifier', 'modules.fuzzy_surface',
+                'modules.fuzzy_stream', 'modules.fuzzy_cache', 'modules.fuzzy_metrics', 'modules.fuzzy_generate',
+                'modules.fuzzy_incremental', 'modules.fuzzy_memo', 'modules.fuzzy_server']
+HEAVY_MODULES = ['seaborn', 'matplotlib', 'scipy', 'skfuzzy', 'pandas']
+
+_PROBE = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, ','.join(m for m in {heavy!r} if m in sys.modules))
+'''
+
+
+def measure_import(module, repeats=3):
+    '''
+    Measures the import time of a module in fresh interpreters.
+
+        Args:
+            module(str): the dotted module name
+            repeats(int): number of fresh interpreters to measure, the fastest one is kept (def: 3)
+
+        Returns:
+            elapsed(float): the import time in seconds
+            heavy(list): the heavy packages loaded as a side effect of the import
+
+    '''
+
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    timings = []
+    for _ in range(repeats):
+        output = subprocess.check_output([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                         cwd=root, env=env, universal_newlines=True)
+        elapsed, heavy = output.split(' ')
+        timings.append(float(elapsed))
+    return min(timings), [m for m in heavy.strip().split(',') if m]
+
+
+def check_import_budget(budget=0.5, repeats=3):
+    '''
+    Checks every core module against the import-time budget and prints a report.
+
+        Args:
+            budget(float): the maximum import time of a core module in seconds (def: 0.5)
+            repeats(int): number of fresh interpreters per module (def: 3)
+
+        Returns:
+            passed(bool): True if every module is within budget and loads no heavy package
+
+    '''
+
+
+    passed = True
+    for module in CORE_MODULES:
+        elapsed, heavy = measure_import(module, repeats)
+        ok = elapsed <= budget and not heavy
+        passed = passed and ok
+        print('{:<40} {:7.3f}s {}{}'.format(module, elapsed, 'ok' if ok else 'OVER BUDGET',
+                                            ' (loads {})'.format(', '.join(heavy)) if heavy else ''))
+    return passed
+
+
+if __name__ == '__main__':
+    # argv[1] = import-time budget per core module in seconds (optional, def. 0.5)
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    sys.exit(0 if check_import_budget(budget) else 1)
@@ -0,0 +1,18 @@
+import sys
+
+from modules.fuzzy_generate import write_knowledge_base
+
+if __name__ == '__main__':
+    # argv[1] = output file name, argv[2] = number of antecedents, argv[3] = terms per variable,
+    # argv[4] = number of rules, argv[5] = premises per rule, as n or min-max (optional, def. 2),
+    # argv[6] = share of OR rules (optional, def. 0), argv[7] = measurement rows (optional, def. 1),
+    # argv[8] = seed (optional, def. 0); more than one measurement row is also written to <output>.csv
+    premises = sys.argv[5].split('-') if len(sys.argv) > 5 else ['2']
+    n_premises = int(premises[0]) if len(premises) == 1 else (int(premises[0]), int(premises[1]))
+    n_measurements = int(sys.argv[7]) if len(sys.argv) > 7 else 1
+    measurements_file = sys.argv[1].rsplit('.', 1)[0] + '.csv' if n_measurements > 1 else None
+
+    write_knowledge_base(sys.argv[1], measurements_file, n_variables=int(sys.argv[2]), n_terms=int(sys.argv[3]),
+                         n_rules=int(sys.argv[4]), n_premises=n_premises,
+                         or_ratio=float(sys.argv[6]) if len(sys.argv) > 6 else 0.0,
+                         n_measurements=n_measurements, seed=int(sys.argv[8]) if len(sys.argv) > 8 else 0)
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+
+
+async def open_client(host, port, path):
+    if path is not None:
+        return await asyncio.open_unix_connection(path)
+    return await asyncio.open_connection(host, port)
+
+
+async def request(reader, writer, method, url, payload=None):
+    '''
+    Sends one HTTP/1.1 request on a kept-alive connection and reads the JSON response.
+
+        Args:
+            reader(asyncio.StreamReader): the connection reader
+            writer(asyncio.StreamWriter): the connection writer
+            method(str): the HTTP method
+            url(str): the request path
+            payload(object): the JSON body (def: None)
+
+        Returns:
+            status(int): the HTTP status code
+            response(object): the decoded JSON response
+
+    '''
+
+
+    body = b'' if payload is None else json.dumps(payload).encode()
+    writer.write('{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'
+                 .format(method, url, len(body)).encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads((await reader.readexactly(length)).decode())
+
+
+async def producer(host, port, path, url, rows, latencies, errors):
+    reader, writer = await open_client(host, port, path)
+    try:
+        for row in rows:
+            start = time.perf_counter()
+            status, _ = await request(reader, writer, 'POST', url, {'inputs': row})
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def load_test(host, port, path, model, n_requests, concurrency, seed=0):
+    '''
+    Sends single-row inference requests from concurrent kept-alive connections.
+
+        Args:
+            host(str): the server host
+            port(int): the server port
+            path(str): the server Unix socket path, used instead of TCP if given
+            model(str): the served model name (def: the first one)
+            n_requests(int): total number of requests
+            concurrency(int): number of concurrent connections
+            seed(int): seed of the random measurements (def: 0)
+
+        Returns:
+            report(dict): throughput in requests per second, latency percentiles in milliseconds and error count
+
+    '''
+
+
+    reader, writer = await open_client(host, port, path)
+    _, models = await request(reader, writer, 'GET', '/models')
+    writer.close()
+    model = model or sorted(models)[0]
+    rng = np.random.RandomState(seed)
+    ranges = models[model]['antecedents']
+    rows = [{var_name: float(rng.uniform(low, high)) for var_name, (low, high) in ranges.items()}
+            for _ in range(n_requests)]
+
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[producer(host, port, path, '/infer/' + model, rows[i::concurrency], latencies, errors)
+                           for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000.0
+    return {'model': model, 'requests': len(latencies), 'concurrency': concurrency, 'errors': len(errors),
+            'throughput': len(latencies) / elapsed, 'latency_p50_ms': float(np.percentile(latencies, 50)),
+            'latency_p90_ms': float(np.percentile(latencies, 90)),
+            'latency_p99_ms': float(np.percentile(latencies, 99))}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load-test a running inference server')
+    parser.add_argument('--host', default='127.0.0.1', help='server host')
+    parser.add_argument('--port', type=int, default=8080, help='server port')
+    parser.add_argument('--unix', help='server Unix socket path, used instead of TCP')
+    parser.add_argument('--model', help='served model name (def: the first one)')
+    parser.add_argument('--requests', type=int, default=10000, help='total number of requests')
+    parser.add_argument('--concurrency', type=int, default=64, help='number of concurrent connections')
+    args = parser.parse_args()
+
+    report = asyncio.run(load_test(args.host, args.port, args.unix, args.model, args.requests, args.concurrency))
+    json.dump(report, sys.stdout, indent=1)
+    print()
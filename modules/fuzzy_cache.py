@@ -0,0 +1,275 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from modules.fuzzy_load import PARSER_VERSION, KnowledgeBase
+from modules.fuzzy_membership import create_membership_functions
+
+# bump whenever the layout of the cache files changes
+CACHE_VERSION = 2
+
+_LIST_ATTRIBUTES = ['var_names', 'antecedents', 'consequents', 'term_offsets']
+_ARRAY_ATTRIBUTES = ['premise_index', 'rule_is_or', 'result_vars', 'result_terms']
+_CONNECTORS = ['SIMPLE', 'AND', 'OR']
+_ALIGNMENT = 16
+
+
+def cache_paths(file):
+    '''
+    Returns the paths of the compiled cache stored next to a knowledge base file.
+
+        Args:
+            file(str): the knowledge base filename
+
+        Returns:
+            meta_file(str): the JSON header with the names and the array layout
+            data_prefix(str): the prefix of the memory-mapped .npy array file
+
+    '''
+
+
+    return file + '.cache.json', file + '.cache.'
+
+
+def _settings(resolution, adaptive):
+    return json.loads(json.dumps([resolution, adaptive], sort_keys=True))
+
+
+def _cache_key(content, resolution, adaptive):
+    key = hashlib.sha256(content)
+    key.update(json.dumps([PARSER_VERSION, CACHE_VERSION, _settings(resolution, adaptive)]).encode())
+    return key.hexdigest()
+
+
+def _read_meta(meta_file):
+    try:
+        with open(meta_file) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path, write, mode):
+    # mkstemp creates the file with mode 0600, give it the permissions of the source file instead
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            write(fp)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _file_mode(stat):
+    return stat.st_mode & 0o666
+
+
+def _write_meta(meta_file, meta, mode):
+    _write_atomic(meta_file, lambda fp: fp.write(json.dumps(meta).encode()), mode)
+
+
+def save_compiled_cache(file, kb, tables, content, resolution=0.1, adaptive=None, stat=None):
+    '''
+    Stores a parsed knowledge base and its membership tables next to the source file.
+    The rule index arrays, the term parameters and the tables are laid out in one .npy file named after
+    the cache key. The JSON file is a small header with the key, the names and the byte offset, type
+    and shape of every array; it is written last, so it never points to a missing array file.
+
+        Args:
+            file(str): the knowledge base filename
+            kb(KnowledgeBase): the compiled knowledge base
+            tables(tuple): the output of create_membership_functions for kb
+            content(bytes): the source file content kb was parsed from
+            resolution(float or dict): the sampling step the tables were generated with (def. 0.1)
+            adaptive(float or dict): the adaptive step the tables were generated with (def. None)
+            stat(os.stat_result): the stat of the source file taken before reading content (def. None - stat it now)
+
+    '''
+
+
+    fuzzy_dict, x_ranges, var_names, _ = tables
+    meta_file, data_prefix = cache_paths(file)
+    key = _cache_key(content, resolution, adaptive)
+    if stat is None:
+        stat = os.stat(file)
+    layout = {}
+    chunks = []
+    offset = 0
+
+    def add(name, array, dtype=np.float64):
+        nonlocal offset
+        array = np.ascontiguousarray(array, dtype=dtype)
+        # keep every array aligned, so it can be viewed in place from the mapped file
+        padding = -offset % _ALIGNMENT
+        chunks.append(bytes(padding))
+        offset += padding
+        layout[name] = [offset, array.dtype.str, list(array.shape)]
+        chunks.append(array.tobytes())
+        offset += array.nbytes
+
+    for attribute in _ARRAY_ATTRIBUTES:
+        add(attribute, getattr(kb, attribute), getattr(kb, attribute).dtype)
+    add('rule_connectors', [_CONNECTORS.index(rule['connector']) for rule in kb.compiled_rules], np.int8)
+    for var_name in kb.var_names:
+        add('params/' + var_name, kb.term_params[var_name])
+    for var_name in var_names:
+        add('range/' + var_name, x_ranges[var_name])
+        for term_name, membership in fuzzy_dict[var_name].items():
+            add('mfx/' + var_name + '/' + term_name, membership)
+
+    data_file = data_prefix + key[:16] + '.npy'
+    _write_atomic(data_file, lambda fp: np.save(fp, np.frombuffer(b''.join(chunks), dtype=np.uint8)),
+                  _file_mode(stat))
+
+    meta = {'parser_version': PARSER_VERSION, 'cache_version': CACHE_VERSION, 'key': key,
+            'settings': _settings(resolution, adaptive), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+            'data_file': os.path.basename(data_file), 'layout': layout,
+            'n_terms': int(kb.n_terms), 'table_vars': var_names, 'term_names': kb.term_names,
+            'measurements': {k: float(v) for k, v in kb.measurements.items()}}
+    for attribute in _LIST_ATTRIBUTES:
+        meta[attribute] = [v if isinstance(v, str) else int(v) for v in getattr(kb, attribute)]
+
+    old_meta = _read_meta(meta_file)
+    _write_meta(meta_file, meta, _file_mode(stat))
+    if old_meta is not None and old_meta.get('data_file') != meta['data_file']:
+        try:
+            os.remove(os.path.join(os.path.dirname(os.path.abspath(file)), old_meta['data_file']))
+        except OSError:
+            pass
+
+
+class _CachedKnowledgeBase(KnowledgeBase):
+    '''
+    Knowledge base restored from a compiled cache. Only the index arrays are mapped on load: the variable
+    dictionary and the rule objects are rebuilt from them on first access.
+    '''
+
+
+    def __getattr__(self, name):
+        if name == 'variables':
+            value = {var_name: dict(zip(self.term_names[var_name], self.term_params[var_name].tolist()))
+                     for var_name in self.var_names}
+        elif name == 'compiled_rules':
+            value = self._decompile_rules()
+        elif name == 'rules':
+            def term(var_idx, term_idx):
+                return self.var_names[var_idx], self.term_names[self.var_names[var_idx]][term_idx]
+
+            value = [{'precedents': dict(term(*premise) for premise in rule['premises']),
+                      'connector': rule['connector'], 'result': dict([term(*rule['result'])])}
+                     for rule in self.compiled_rules]
+        else:
+            raise AttributeError(name)
+        setattr(self, name, value)
+        return value
+
+    def _decompile_rules(self):
+        counts = [len(self.term_names[var_name]) for var_name in self.var_names]
+        column_vars = np.repeat(np.arange(len(counts)), counts).tolist()
+        column_terms = (np.arange(self.n_terms) - np.repeat(self.term_offsets, counts)).tolist()
+        compiled_rules = []
+        for columns, connector, result_var, result_term in zip(self.premise_index.tolist(),
+                                                               self._rule_connectors.tolist(),
+                                                               self.result_vars.tolist(), self.result_terms.tolist()):
+            # the padding columns n_terms and n_terms + 1 follow the premises
+            compiled_rules.append({'premises': [(column_vars[c], column_terms[c]) for c in columns if c < self.n_terms],
+                                   'connector': _CONNECTORS[connector],
+                                   'result': (result_var, result_term)})
+        return compiled_rules
+
+
+def _restore(meta, data):
+    def view(name):
+        offset, dtype, shape = meta['layout'][name]
+        dtype = np.dtype(dtype)
+        return data[offset:offset + dtype.itemsize * int(np.prod(shape))].view(dtype).reshape(shape)
+
+    kb = _CachedKnowledgeBase.__new__(_CachedKnowledgeBase)
+    kb.measurements = {k: np.float32(v) for k, v in meta['measurements'].items()}
+    kb.term_names = meta['term_names']
+    kb.n_terms = meta['n_terms']
+    for attribute in _LIST_ATTRIBUTES:
+        setattr(kb, attribute, meta[attribute])
+    kb.term_params = {var_name: view('params/' + var_name) for var_name in kb.var_names}
+    for attribute in _ARRAY_ATTRIBUTES:
+        setattr(kb, attribute, view(attribute))
+    kb._rule_connectors = view('rule_connectors')
+
+    fuzzy_dict = {}
+    x_ranges = {}
+    for var_name in meta['table_vars']:
+        x_ranges[var_name] = view('range/' + var_name)
+        fuzzy_dict[var_name] = {term_name: view('mfx/' + var_name + '/' + term_name)
+                                for term_name in kb.term_names[var_name]}
+    return kb, (fuzzy_dict, x_ranges, list(meta['table_vars']), kb.variables)
+
+
+def load_compiled_knowledge_base(file, resolution=0.1, adaptive=None, write_cache=True):
+    '''
+    Loads a knowledge base and its membership tables through a compiled cache next to the source file.
+    The cache is valid while the parser and cache versions, the table settings and the source content
+    are unchanged: an unchanged modification time and size are trusted, otherwise the content hash decides.
+    A valid cache is memory-mapped read-only, so the tables are shared by every process that loads it;
+    the cache files get the read and write permissions of the source file.
+    A missing or stale cache is rebuilt from the source file.
+
+        Args:
+            file(str): the knowledge base filename
+            resolution(float or dict): the sampling step of the membership tables (def. 0.1)
+            adaptive(float or dict): coarse step for adaptive sampling around the breakpoints (def. None)
+            write_cache(bool): store a rebuilt cache next to the source file (def. True)
+
+        Returns:
+            kb(KnowledgeBase): the compiled knowledge base
+            tables(tuple): fuzzy_dict, x_ranges, var_names and fuzzy_variables (see create_membership_functions)
+
+    '''
+
+
+    meta_file, _ = cache_paths(file)
+    stat = os.stat(file)
+    meta = _read_meta(meta_file)
+    content = None
+    if meta is not None and meta.get('parser_version') == PARSER_VERSION and \
+            meta.get('cache_version') == CACHE_VERSION and meta.get('settings') == _settings(resolution, adaptive):
+        fresh = meta['mtime_ns'] == stat.st_mtime_ns and meta['size'] == stat.st_size
+        if not fresh:
+            with open(file, 'rb') as fp:
+                content = fp.read()
+            fresh = meta['key'] == _cache_key(content, resolution, adaptive)
+            if fresh and write_cache:
+                # the file was touched but not changed, remember its new modification time
+                meta['mtime_ns'], meta['size'] = stat.st_mtime_ns, stat.st_size
+                try:
+                    _write_meta(meta_file, meta, _file_mode(stat))
+                except OSError:
+                    pass
+        if fresh:
+            try:
+                data = np.load(os.path.join(os.path.dirname(os.path.abspath(file)), meta['data_file']),
+                               mmap_mode='r')
+                kb, tables = _restore(meta, data)
+                # the name is the path the file was opened with, not the one it was first cached under
+                kb.name = file
+                return kb, tables
+            except (OSError, ValueError):
+                pass
+
+    if content is None:
+        with open(file, 'rb') as fp:
+            content = fp.read()
+    # decode with universal newlines, as load_knowledge_base reads the file in text mode
+    kb = KnowledgeBase(io.TextIOWrapper(io.BytesIO(content)).read(), name=file)
+    tables = create_membership_functions(kb, resolution=resolution, adaptive=adaptive)
+    if write_cache:
+        try:
+            save_compiled_cache(file, kb, tables, content, resolution, adaptive, stat)
+        except OSError:
+            pass
+    return kb, tables
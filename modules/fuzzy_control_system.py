@@ -1,20 +1,26 @@
 ### Scikit-fuzzy
 
-import seaborn as sns
-import matplotlib.pyplot as plt
+import functools
+import logging
+import operator
+import queue
 
+from modules.fuzzy_inference import consequent_heights, fire_rules_batch
 from modules.fuzzy_load import *
+from modules.fuzzy_membership import create_membership_functions
+from modules.fuzzy_plot import import_plotting
 
-sns.set(style='darkgrid', palette="Paired")
 from skfuzzy import control as ctrl
 
+logger = logging.getLogger(__name__)
+
 
 def map_variable_types(measurement_file, fuzzy_variables, var_names, x_ranges, fuzzy_dict):
     '''
     Creates a lookup mapping of the current fuzzy variables using skfuzzy ctrl objects (Anticedent and Consequent).
     
         Args:
-            measurement_file(str): the input knowledge base file name
+            measurement_file(str or KnowledgeBase): the input knowledge base file name or compiled knowledge base
             fuzzy_variables(dict): the processed fuzzy dictionary with memberships
             var_names(list): lookup list with variable names
             x_ranges(dict): membership ranges for each fuzzy variable
@@ -28,7 +34,10 @@ def map_variable_types(measurement_file, fuzzy_variables, var_names, x_ranges, f
 
 
     var_type_list = []
-    fuzzy_measurements = read_measurements(measurement_file, fuzzy_variables)
+    if isinstance(measurement_file, KnowledgeBase):
+        fuzzy_measurements = dict(measurement_file.measurements)
+    else:
+        fuzzy_measurements = read_measurements(measurement_file, fuzzy_variables)
     for var_name in var_names:
         if var_name in fuzzy_measurements.keys():
             antecedent = ctrl.Antecedent(x_ranges[var_name], var_name)
@@ -56,6 +65,7 @@ def view_sample_set(fuzzy_set, target_category):
     '''
 
 
+    import_plotting()
     return fuzzy_set[target_category].view()
 
 
@@ -64,7 +74,7 @@ def create_rule_control_system(file, fuzzy_vars, var_names, vmfx_list):
     Creates skfuzzy Rule objects based of the dictionary of rules.
     
         Args:
-            file(str): the input knowledge base file name
+            file(str or KnowledgeBase): the input knowledge base file name or compiled knowledge base
             fuzzy_vars(dict): the processed fuzzy dictionary with memberships
             var_names(list): lookup list with variable names
             vmfx_list(list): list of dictionaries containing the variable names, ranges and membership functions
@@ -73,80 +83,35 @@ def create_rule_control_system(file, fuzzy_vars, var_names, vmfx_list):
             rcs(list): a list of dictionaries representing the rules within the control system
             
     '''
-    # can handle up to 5 consecutive AND or OR connectors
 
 
-    fuzzy_rules = read_rulebase(file, fuzzy_vars)
+    if isinstance(file, KnowledgeBase):
+        fuzzy_rules = file.rules
+    else:
+        fuzzy_rules = read_rulebase(file, fuzzy_vars)
     rcs = []
     idx = 1
     for fuzzy_dict in fuzzy_rules:
-        if fuzzy_dict['connector'] == 'AND' or fuzzy_dict['connector'] == 'OR':
-            rule_prec_list = []
-            result = ""
-            for k_j, v_j in fuzzy_dict['precedents'].items():
-                if k_j in var_names:
-                    for vmfx in vmfx_list:
-                        if vmfx.label == k_j:
-                            rule_prec_list.append(vmfx[str(v_j)])
-
-            for k_r, v_r in fuzzy_dict['result'].items():
-                if k_r in var_names:
-                    for vmfx in vmfx_list:
-                        if vmfx.label == k_r:
-                            result = vmfx[str(v_r)]
-
-                if fuzzy_dict['connector'] == 'AND':
-                    if len(rule_prec_list) == 2:
-                        rule_i = ctrl.Rule(rule_prec_list[0] & rule_prec_list[1], result, label='R' + str(idx))
-                    elif len(rule_prec_list) == 3:
-                        rule_i = ctrl.Rule(rule_prec_list[0] & rule_prec_list[1] & rule_prec_list[2], result,
-                                           label='R' + str(idx))
-                    elif len(rule_prec_list) == 4:
-                        rule_i = ctrl.Rule(
-                            rule_prec_list[0] & rule_prec_list[1] & rule_prec_list[2] & rule_prec_list[3], result,
-                            label='R' + str(idx))
-                    elif len(rule_prec_list) == 5:
-                        rule_i = ctrl.Rule(
-                            rule_prec_list[0] & rule_prec_list[1] & rule_prec_list[2] & rule_prec_list[3] &
-                            rule_prec_list[4], result, label='R' + str(idx))
-                elif fuzzy_dict['connector'] == 'OR':
-                    if len(rule_prec_list) == 2:
-                        rule_i = ctrl.Rule(rule_prec_list[0] | rule_prec_list[1], result, label='R' + str(idx))
-                    elif len(rule_prec_list) == 3:
-                        rule_i = ctrl.Rule(rule_prec_list[0] | rule_prec_list[1] | rule_prec_list[2], result,
-                                           label='R' + str(idx))
-                    elif len(rule_prec_list) == 4:
-                        rule_i = ctrl.Rule(
-                            rule_prec_list[0] | rule_prec_list[1] | rule_prec_list[2] | rule_prec_list[3], result,
-                            label='R' + str(idx))
-                    elif len(rule_prec_list) == 5:
-                        rule_i = ctrl.Rule(
-                            rule_prec_list[0] | rule_prec_list[1] | rule_prec_list[2] | rule_prec_list[3] |
-                            rule_prec_list[4], result, label='R' + str(idx))
-                else:
-                    print('Input rule is too complex to be translated')
-                    return
-                idx += 1
-
-            if rule_i is not None:
-                rcs.append(rule_i)
-        elif fuzzy_dict['connector'] == 'SIMPLE':
-            rule_prec = ""
-            result = ""
-            for k_j, v_j in fuzzy_dict['precedents'].items():
-                if k_j in var_names:
-                    for vmfx in vmfx_list:
-                        if vmfx.label == k_j:
-                            rule_prec = vmfx[str(v_j)]
-            for k_r, v_r in fuzzy_dict['result'].items():
-                if k_r in var_names:
-                    for vmfx in vmfx_list:
-                        if vmfx.label == k_r:
-                            result = vmfx[str(v_r)]
-
-            rule_i = ctrl.Rule(rule_prec, result, label='R' + str(idx))
-            rcs.append(rule_i)
-            idx += 1
+        rule_prec_list = []
+        result = ""
+        for k_j, v_j in fuzzy_dict['precedents'].items():
+            if k_j in var_names:
+                for vmfx in vmfx_list:
+                    if vmfx.label == k_j:
+                        rule_prec_list.append(vmfx[str(v_j)])
+        for k_r, v_r in fuzzy_dict['result'].items():
+            if k_r in var_names:
+                for vmfx in vmfx_list:
+                    if vmfx.label == k_r:
+                        result = vmfx[str(v_r)]
+
+        # premises of any count are chained with & (AND) or | (OR)
+        if fuzzy_dict['connector'] == 'OR':
+            rule_prec = functools.reduce(operator.or_, rule_prec_list)
+        else:
+            rule_prec = functools.reduce(operator.and_, rule_prec_list)
+        rcs.append(ctrl.Rule(rule_prec, result, label='R' + str(idx)))
+        idx += 1
 
     return rcs
 
@@ -161,6 +126,7 @@ def plot_rule_graphs(rule_list):
     '''
 
 
+    sns, plt = import_plotting()
     for rule in rule_list:
         rule.view()
         plt.show()
@@ -188,17 +154,17 @@ def apply_rules(rcs, fuzzy_measurements, var_names, vmfx_list):
     ctr_sys_sim = ctrl.ControlSystemSimulation(ctrl_sys)
     ctr_sys_sim.reset()
     target_consequent = ""
-    print('--- Measurements ---')
+    logger.debug('--- Measurements ---')
     for k, v in fuzzy_measurements.items():
         if k in var_names:
-            print(str(str(k) + ' = ' + str(v)))
+            logger.debug('%s = %s', k, v)
             ctr_sys_sim.input[str(k)] = v
 
     ctr_sys_sim.compute()
-    print('--- Simulation results ---')
+    logger.debug('--- Simulation results ---')
     for vmfx in vmfx_list:
         if isinstance(vmfx, ctrl.Consequent):
-            print(str(str(vmfx.label) + ' = ' + str(ctr_sys_sim.output[str(vmfx.label)])))
+            logger.debug('%s = %s', vmfx.label, ctr_sys_sim.output[str(vmfx.label)])
             target_consequent = vmfx
     return ctr_sys_sim, target_consequent
 
@@ -214,5 +180,152 @@ def view_defuzz(result_set, ctr_sys_sim):
     '''
 
 
+    sns, plt = import_plotting()
     result_set.view(sim=ctr_sys_sim)
     plt.show()
+
+
+class FuzzyControlSystem:
+    '''
+    Long-lived skfuzzy control system. The membership functions are generated once, and a pool of
+    ControlSystemSimulation objects is reused across calls. skfuzzy flushes its cached results for every
+    simulation attached to a ControlSystem at once, so each pooled simulation owns its own Antecedent/Consequent
+    objects, rules and ControlSystem, and concurrent callers never share a simulation.
+
+        Attributes:
+            kb(KnowledgeBase): the compiled knowledge base
+            consequents(list): the consequent labels returned by compute and compute_many
+
+    '''
+
+
+    def __init__(self, file, pool_size=4, flush_after_run=1000):
+        '''
+        Builds the membership functions and the pool of simulations.
+
+            Args:
+                file(str or KnowledgeBase): the input knowledge base file name or compiled knowledge base
+                pool_size(int): number of pooled simulation objects for single computations (def: 4)
+                flush_after_run(int): number of cached single computations kept by each simulation (def: 1000)
+
+        '''
+
+
+        self.kb = as_knowledge_base(file)
+        self._tables = create_membership_functions(self.kb)
+        self._flush_after_run = flush_after_run
+        self.consequents = list(self.kb.consequents)
+
+        # single computations keep the input cache; array computations disable it, so they get their own pool
+        self._sim_pool = queue.LifoQueue()
+        for _ in range(pool_size):
+            self._sim_pool.put(self._build_simulation(cache=True))
+        self._array_sim_pool = queue.LifoQueue()
+
+    def _build_simulation(self, cache):
+        fuzzy_dict, x_ranges, var_names, fuzzy_variables = self._tables
+        vmfx_list = []
+        for var_name in var_names:
+            if var_name in self.kb.antecedents:
+                vmfx = ctrl.Antecedent(x_ranges[var_name], var_name)
+            else:
+                vmfx = ctrl.Consequent(x_ranges[var_name], var_name)
+            for k_j, v_j in fuzzy_dict[var_name].items():
+                vmfx[str(k_j)] = v_j
+            vmfx_list.append(vmfx)
+
+        rcs = create_rule_control_system(self.kb, fuzzy_variables, var_names, vmfx_list)
+        return ctrl.ControlSystemSimulation(ctrl.ControlSystem(rcs), cache=cache,
+                                            flush_after_run=self._flush_after_run)
+
+    def compute(self, inputs):
+        '''
+        Performs inference and centroid defuzzification for a single measurement dictionary.
+
+            Args:
+                inputs(dict): the value of each antecedent
+
+            Returns:
+                outputs(dict): the defuzzified value of each consequent
+
+        '''
+
+
+        sim = self._sim_pool.get()
+        try:
+            for k, v in inputs.items():
+                if k in self.kb.antecedents:
+                    sim.input[str(k)] = v
+            sim.compute()
+            return dict(sim.output)
+        finally:
+            self._sim_pool.put(sim)
+
+    def _fires(self, measurements, antecedents):
+        # fuzzify through the sampled tables, as skfuzzy interpolates them, so the screening matches its result
+        fuzzy_dict, x_ranges, _, _ = self._tables
+        degrees = [None] * len(self.kb.var_names)
+        for col, var_name in enumerate(antecedents):
+            degrees[self.kb.var_names.index(var_name)] = np.column_stack(
+                [np.interp(measurements[:, col], x_ranges[var_name], fuzzy_dict[var_name][term_name])
+                 for term_name in self.kb.term_names[var_name]])
+        strengths = fire_rules_batch(self.kb, degrees)
+        fires = np.ones(measurements.shape[0], dtype=bool)
+        for label in self.consequents:
+            fires &= np.any(consequent_heights(self.kb, strengths, label) > 0, axis=1)
+        # skfuzzy skips NaN memberships in its min/max, so rows with missing values are left to it
+        return fires | np.any(np.isnan(measurements), axis=1)
+
+    def _compute_rows(self, sim, rows, antecedents):
+        try:
+            sim.inputs(dict(zip(antecedents, rows.T.copy())))
+            sim.compute()
+            return {label: np.asarray(sim.output[label], dtype=np.float64).reshape(-1) for label in self.consequents}
+        except (AssertionError, ValueError):
+            if rows.shape[0] == 1:
+                return {label: np.full(1, np.nan) for label in self.consequents}
+        # split the rows, so only the ones skfuzzy rejects are left undefined
+        half = rows.shape[0] // 2
+        first = self._compute_rows(sim, rows[:half], antecedents)
+        second = self._compute_rows(sim, rows[half:], antecedents)
+        return {label: np.concatenate([first[label], second[label]]) for label in self.consequents}
+
+    def compute_many(self, measurements, antecedents=None, chunk_size=1000):
+        '''
+        Performs inference for a batch of measurement vectors using skfuzzy's array-input mode.
+        The rule strengths are computed first, and rows where some consequent has no firing rule are set to NaN
+        without calling skfuzzy. A chunk that skfuzzy still rejects is split until the failing rows are isolated.
+
+            Args:
+                measurements(np.array): (N, n_antecedents) matrix with one measurement vector per row
+                antecedents(list): the variable name of each measurement column (def: kb.antecedents)
+                chunk_size(int): number of rows passed to skfuzzy at once (def: 1000)
+
+            Returns:
+                outputs(dict): (N,) defuzzified values for each consequent
+
+        '''
+
+
+        if antecedents is None:
+            antecedents = self.kb.antecedents
+        measurements = np.atleast_2d(np.asarray(measurements, dtype=np.float64))
+        outputs = {}
+        for label in self.consequents:
+            outputs[label] = np.full(measurements.shape[0], np.nan)
+        valid = np.flatnonzero(self._fires(measurements, antecedents))
+
+        try:
+            sim = self._array_sim_pool.get_nowait()
+        except queue.Empty:
+            sim = self._build_simulation(cache=False)
+        try:
+            for start in range(0, valid.size, chunk_size):
+                rows = valid[start:start + chunk_size]
+                chunk_outputs = self._compute_rows(sim, measurements[rows], antecedents)
+                for label in self.consequents:
+                    outputs[label][rows] = chunk_outputs[label]
+        finally:
+            self._array_sim_pool.put(sim)
+
+        return outputs
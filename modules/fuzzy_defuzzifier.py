@@ -1,8 +1,36 @@
+import logging
+
 import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
 
-sns.set(style='darkgrid', palette="Paired")
+from modules.fuzzy_metrics import count, metrics_enabled, timed
+from modules.fuzzy_plot import import_plotting
+
+logger = logging.getLogger(__name__)
+
+# supported methods of defuzzify_batch, with the labels used in the logs
+DEFUZZ_METHODS = {'centroid': 'Centroid', 'bisector': 'Bisector', 'mom': 'Mean of maximum',
+                  'som': 'Smallest of maximum', 'lom': 'Largest of maximum'}
+
+
+@timed('aggregate')
+def aggregate_activations(activation_dict, n_points=None):
+    '''
+    Aggregates the membership activations of every rule based on their maximum value within the range.
+
+        Args:
+            activation_dict(dict): membership activation values throughout the range
+            n_points(int): size of the consequent range, used when no rule fired (def: None)
+
+        Returns:
+            aggregated_mfx(np.array): the aggregated activation functions for each rule
+
+    '''
+
+
+    if not activation_dict:
+        return np.zeros(n_points)
+    activations = np.vstack(list(activation_dict.values()))
+    return np.fmax(np.fmax.reduce(activations, axis=0), 0.0)
 
 
 def defuzzify_centroid(activation_dict, vmfx_list):
@@ -22,59 +50,16 @@ def defuzzify_centroid(activation_dict, vmfx_list):
     '''
 
 
-    aggregated_mfx = np.zeros_like(list(activation_dict.values())[0])
-
-    for i in range(len(aggregated_mfx)):
-        max_val = 0.0
-        for k, v in activation_dict.items():
-            if v[i] > max_val:
-                max_val = v[i]
-        aggregated_mfx[i] = max_val
-
     for vmfx in vmfx_list:
         if vmfx['type'] == 'Consequent':
             conseq_range = vmfx['range']
             conseq_name = vmfx['name']
 
-    sum_centroid_area = 0.0
-    sum_area = 0.0
-    result = 0.0
-
-    if conseq_range is not None:
-
-        # If the membership function is a singleton fuzzy set:
-        if len(conseq_range) == 1:
-            result = conseq_range[0] * aggregated_mfx[0] / np.float32(aggregated_mfx[0])
-
-        else:
-            # else return the sum of centroid*area/sum of area
-            for i in range(1, len(conseq_range)):
-                x1 = conseq_range[i - 1]
-                x2 = conseq_range[i]
-                y1 = aggregated_mfx[i - 1]
-                y2 = aggregated_mfx[i]
-
-                # if y1 == y2 == 0.0 or x1==x2: --> rectangle of zero height or width
-                if not (y1 == y2 == 0.0 or x1 == x2):
-                    if y1 == y2:  # rectangle
-                        centroid = 0.5 * (x1 + x2)
-                        area = (x2 - x1) * y1
-                    elif y1 == 0.0 and y2 != 0.0:  # triangle, height y2
-                        centroid = 2.0 / 3.0 * (x2 - x1) + x1
-                        area = 0.5 * (x2 - x1) * y2
-                    elif y2 == 0.0 and y1 != 0.0:  # triangle, height y1
-                        centroid = 1.0 / 3.0 * (x2 - x1) + x1
-                        area = 0.5 * (x2 - x1) * y1
-                    else:
-                        centroid = (2.0 / 3.0 * (x2 - x1) * (y2 + 0.5 * y1)) / (y1 + y2) + x1
-                        area = 0.5 * (x2 - x1) * (y1 + y2)
-
-                    sum_centroid_area += centroid * area
-                    sum_area += area
-
-            result = np.round(sum_centroid_area / np.float32(sum_area), 2)
-
-    print('Centroid defuzzified value for {}:{}'.format(conseq_name, result))
+    aggregated_mfx = aggregate_activations(activation_dict, len(conseq_range))
+
+    result = np.round(defuzzify_centroid_batch(conseq_range, aggregated_mfx)[0], 2)
+
+    logger.debug('Centroid defuzzified value for %s:%s', conseq_name, result)
     return result, conseq_range, aggregated_mfx
 
 
@@ -95,82 +80,170 @@ def defuzzify_bisector(activation_dict, vmfx_list):
     '''
 
 
-    aggregated_mfx = np.zeros_like(list(activation_dict.values())[0])
+    for vmfx in vmfx_list:
+        if vmfx['type'] == 'Consequent':
+            conseq_range = vmfx['range']
+            conseq_name = vmfx['name']
+
+    aggregated_mfx = aggregate_activations(activation_dict, len(conseq_range))
+
+    result = np.round(defuzzify_bisector_batch(conseq_range, aggregated_mfx)[0], 2)
+
+    logger.debug('Bisector defuzzified value for %s:%s', conseq_name, result)
+    return result, conseq_range, aggregated_mfx
+
+
+def defuzzify_methods(activation_dict, vmfx_list, methods=('centroid', 'bisector', 'mom', 'som', 'lom')):
+    '''
+    Estimates the defuzzified value with several methods, aggregating the membership activations only once.
+
+        Args:
+            activation_dict(dict): membership activation values throughout the range
+            vmfx_list(list): list of dictionaries containing the variable names, ranges and membership functions
+            methods(list): any of 'centroid', 'bisector', 'mom', 'som' and 'lom' (def: all)
+
+        Returns:
+            results(dict): estimated defuzzified value for each method
+            conseq_range(np.array): the range of possible values for the consequent variable
+            aggregated_mfx(np.array): the aggregated activation functions for each rule
+
+    '''
 
-    for i in range(len(aggregated_mfx)):
-        max_val = 0.0
-        for k, v in activation_dict.items():
-            if v[i] > max_val:
-                max_val = v[i]
-        aggregated_mfx[i] = max_val
 
     for vmfx in vmfx_list:
         if vmfx['type'] == 'Consequent':
             conseq_range = vmfx['range']
             conseq_name = vmfx['name']
 
-    sum_area = 0.0
-    acc_area = [0.0] * (len(conseq_range) - 1)
-    result = 0.0
-
-    if conseq_range is not None:
-
-        # If the membership function is a singleton fuzzy set:
-        if len(conseq_range) == 1:
-            result = conseq_range[0]
-
-        else:
-            # else return the sum of centroid*area/sum of area
-            for i in range(1, len(conseq_range)):
-                x1 = conseq_range[i - 1]
-                x2 = conseq_range[i]
-                y1 = aggregated_mfx[i - 1]
-                y2 = aggregated_mfx[i]
-
-                # if y1 == y2 == 0.0 or x1==x2: --> rectangle of zero height or width
-                if not (y1 == y2 == 0.0 or x1 == x2):
-                    if y1 == y2:  # rectangle
-                        area = (x2 - x1) * y1
-                    elif y1 == 0.0 and y2 != 0.0:  # triangle, height y2
-                        area = 0.5 * (x2 - x1) * y2
-                    elif y2 == 0.0 and y1 != 0.0:  # triangle, height y1
-                        area = 0.5 * (x2 - x1) * y1
-                    else:
-                        area = 0.5 * (x2 - x1) * (y1 + y2)
-
-                    sum_area += area
-                    acc_area[i - 1] = sum_area
-
-            index = np.nonzero(np.array(acc_area) >= sum_area / 2.0)[0][0]
-
-            if index == 0:
-                subarea = 0
-            else:
-                subarea = acc_area[index - 1]
-
-            x1 = conseq_range[index]
-            x2 = conseq_range[index + 1]
-            y1 = aggregated_mfx[index]
-            y2 = aggregated_mfx[index + 1]
-
-            subarea = sum_area / 2.0 - subarea
-
-            diff = x2 - x1
-            if y1 == y2:  # rectangle
-                result = np.round(subarea / y1 + x1, 2)
-            elif y1 == 0.0 and y2 != 0.0:  # triangle, height y2
-                root = np.sqrt(2.0 * subarea * diff / y2)
-                result = np.round((x1 + root), 2)
-            elif y2 == 0.0 and y1 != 0.0:  # triangle, height y1
-                root = np.sqrt(diff * diff - (2.0 * subarea * diff / y1))
-                result = np.round((x2 - root), 2)
-            else:                          # trapezium
-                m = (y2 - y1) / diff
-                root = np.sqrt(y1 * y1 + 2.0 * m * subarea)
-                result = np.round((x1 - (y1 - root) / m), 2)
-
-    print('Bisector defuzzified value for {}:{}'.format(conseq_name, result))
-    return result, conseq_range, aggregated_mfx
+    aggregated_mfx = aggregate_activations(activation_dict, len(conseq_range))
+    results = {}
+    for method, values in defuzzify_batch(conseq_range, aggregated_mfx, methods).items():
+        results[method] = np.round(values[0], 2)
+        logger.debug('%s defuzzified value for %s:%s', DEFUZZ_METHODS[method], conseq_name, results[method])
+    return results, conseq_range, aggregated_mfx
+
+
+def _count_outputs(aggregated_mfx):
+    if metrics_enabled():
+        count('outputs', aggregated_mfx.shape[0])
+        count('zero_activation_outputs', int(np.count_nonzero(~np.any(aggregated_mfx > 0, axis=1))))
+
+
+@timed('defuzzify')
+def defuzzify_batch(conseq_range, aggregated_mfx, methods=('centroid', 'bisector')):
+    '''
+    Estimates the defuzzified values of a stack of aggregated activation functions with several methods in one pass.
+    The trapezoid area of every segment is shared by the centroid and the bisector, and the mask of the
+    maximum membership by the mean, smallest and largest of maximum (which follow scikit-fuzzy's definitions
+    over the sampled points).
+    The centroid of every linear segment is integrated in closed form, which gives the same result
+    as the segment walk of defuzzify_centroid. For the bisector, the segment holding half of the total area
+    is located from the cumulative trapezoid areas and the bisecting point inside it is solved in closed form.
+
+        Args:
+            conseq_range(np.array): the range of possible values for the consequent variable, shared (grid,) or per row (N, grid)
+            aggregated_mfx(np.array): (N, grid) aggregated activation functions
+            methods(list): any of 'centroid', 'bisector', 'mom', 'som' and 'lom' (def: ('centroid', 'bisector'))
+
+        Returns:
+            results(dict): (N,) estimated defuzzified values for each method (NaN where the aggregated area is zero)
+
+    '''
+
+
+    for method in methods:
+        if method not in DEFUZZ_METHODS:
+            raise ValueError('Unknown defuzzification method {}'.format(method))
+    y = np.atleast_2d(aggregated_mfx)
+    x = np.broadcast_to(np.asarray(conseq_range, dtype=np.float64), y.shape)
+    _count_outputs(y)
+    if y.shape[1] == 1:
+        return {method: np.where(y[:, 0] > 0, x[:, 0], np.nan) for method in methods}
+
+    results = {}
+    rows = np.arange(y.shape[0])
+    x1, x2 = x[:, :-1], x[:, 1:]
+    y1, y2 = y[:, :-1], y[:, 1:]
+    diff = x2 - x1
+    if 'centroid' in methods or 'bisector' in methods:
+        areas = 0.5 * diff * (y1 + y2)
+
+    if 'centroid' in methods:
+        sum_area = np.sum(areas, axis=1)
+        sum_centroid_area = np.sum(diff / 6.0 * (y1 * (2.0 * x1 + x2) + y2 * (x1 + 2.0 * x2)), axis=1)
+        centroid = np.full(y.shape[0], np.nan)
+        nonzero = sum_area > 0
+        centroid[nonzero] = sum_centroid_area[nonzero] / sum_area[nonzero]
+        results['centroid'] = centroid
+
+    if 'bisector' in methods:
+        acc_area = np.cumsum(areas, axis=1)
+        sum_area = acc_area[:, -1]
+
+        # row-wise searchsorted: the first segment whose accumulated area reaches half of the total
+        index = np.minimum(np.sum(acc_area < sum_area[:, None] / 2.0, axis=1), y.shape[1] - 2)
+        subarea = sum_area / 2.0 - np.where(index > 0, acc_area[rows, index - 1], 0.0)
+
+        bx1 = x[rows, index]
+        bdiff = x[rows, index + 1] - bx1
+        by1 = y[rows, index]
+        by2 = y[rows, index + 1]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rectangle = subarea / by1 + bx1
+            m = (by2 - by1) / bdiff
+            trapezium = bx1 - (by1 - np.sqrt(np.maximum(by1 * by1 + 2.0 * m * subarea, 0.0))) / m
+        bisector = np.where(by1 == by2, rectangle, trapezium)
+        bisector[~(sum_area > 0)] = np.nan
+        results['bisector'] = bisector
+
+    if 'mom' in methods or 'som' in methods or 'lom' in methods:
+        peak = np.max(y, axis=1)
+        at_peak = y == peak[:, None]
+        defined = peak > 0
+        if 'mom' in methods:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                results['mom'] = np.where(defined, np.sum(x * at_peak, axis=1) / np.sum(at_peak, axis=1), np.nan)
+        if 'som' in methods:
+            results['som'] = np.where(defined, x[rows, np.argmax(at_peak, axis=1)], np.nan)
+        if 'lom' in methods:
+            results['lom'] = np.where(defined, x[rows, y.shape[1] - 1 - np.argmax(at_peak[:, ::-1], axis=1)], np.nan)
+
+    return {method: results[method] for method in methods}
+
+
+def defuzzify_centroid_batch(conseq_range, aggregated_mfx):
+    '''
+    Estimates the centroid defuzzified values for a stack of aggregated activation functions, see defuzzify_batch.
+
+        Args:
+            conseq_range(np.array): the range of possible values for the consequent variable, shared (grid,) or per row (N, grid)
+            aggregated_mfx(np.array): (N, grid) aggregated activation functions
+
+        Returns:
+            results(np.array): (N,) estimated defuzzified values (NaN where the aggregated area is zero)
+
+    '''
+
+
+    return defuzzify_batch(conseq_range, aggregated_mfx, ['centroid'])['centroid']
+
+
+def defuzzify_bisector_batch(conseq_range, aggregated_mfx):
+    '''
+    Estimates the bisector defuzzified values for a stack of aggregated activation functions, see defuzzify_batch.
+
+        Args:
+            conseq_range(np.array): the range of possible values for the consequent variable, shared (grid,) or per row (N, grid)
+            aggregated_mfx(np.array): (N, grid) aggregated activation functions
+
+        Returns:
+            results(np.array): (N,) estimated defuzzified values (NaN where the aggregated area is zero)
+
+    '''
+
+
+    return defuzzify_batch(conseq_range, aggregated_mfx, ['bisector'])['bisector']
 
 
 def plot_defuzz(vmfx_list, fuzzy_dict, c_res, c_x, c_mfx, b_res, b_x, b_mfx):
@@ -191,6 +264,7 @@ def plot_defuzz(vmfx_list, fuzzy_dict, c_res, c_x, c_mfx, b_res, b_x, b_mfx):
     '''
 
 
+    sns, plt = import_plotting()
     tip0 = np.zeros_like(c_x)
     for vmfx in vmfx_list:
         if vmfx['type'] == 'Consequent':
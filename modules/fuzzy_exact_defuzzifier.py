@@ -0,0 +1,169 @@
+import numpy as np
+
+from modules.fuzzy_defuzzifier import defuzzify_bisector_batch, defuzzify_centroid_batch
+from modules.fuzzy_inference import consequent_heights, fire_rules_batch, fuzzify_batch
+from modules.fuzzy_membership import trapezoid_membership
+from modules.fuzzy_metrics import timed
+
+
+def static_breakpoints(term_params):
+    '''
+    Collects the breakpoints of the aggregated consequent that do not depend on the firing strengths:
+    the feet of every trapezoid and the crossings between the sloped sides of different terms.
+
+        Args:
+            term_params(np.array): (n_terms, 4) matrix with the 4-tuple of each consequent term
+
+        Returns:
+            breakpoints(np.array): sorted unique x coordinates
+
+    '''
+
+
+    a, b, alpha, beta = np.asarray(term_params, dtype=np.float64).T
+    left, right = a - alpha, b + beta
+    alpha_i, alpha_j = alpha[:, None], alpha[None, :]
+    beta_i, beta_j = beta[:, None], beta[None, :]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # rising side of term i against the falling side of term j
+        rise_fall = (left[:, None] * beta_j + right[None, :] * alpha_i) / (alpha_i + beta_j)
+        # rising sides (and falling sides) of two terms with different slopes
+        rise_rise = (left[:, None] * alpha_j - left[None, :] * alpha_i) / (alpha_j - alpha_i)
+        fall_fall = (right[:, None] * beta_j - right[None, :] * beta_i) / (beta_j - beta_i)
+
+    breakpoints = np.concatenate([left, right, rise_fall.ravel(), rise_rise.ravel(), fall_fall.ravel()])
+    return np.unique(breakpoints[np.isfinite(breakpoints)])
+
+
+@timed('aggregate')
+def aggregate_breakpoints(term_params, heights, universe=None, static=None):
+    '''
+    Builds the exact piecewise-linear representation of the max-aggregate of clipped trapezoids.
+    The candidate breakpoints are the static ones plus the points where each sloped side reaches a clipping height.
+    The aggregate is linear between two consecutive candidates, so its limits at both ends of every
+    segment are recovered exactly from two interior evaluations, which also handles vertical sides.
+
+        Args:
+            term_params(np.array): (n_terms, 4) matrix with the 4-tuple of each consequent term
+            heights(np.array): (N, n_terms) clipping height of each term
+            universe(tuple): optional (low, high) bounds the aggregate is restricted to (def: None - the term supports)
+            static(np.array): precomputed static_breakpoints(term_params) (def: None)
+
+        Returns:
+            x(np.array): (N, points) non-decreasing x coordinates of the aggregate polygon
+            y(np.array): (N, points) aggregate membership values, with discontinuities as repeated x coordinates
+
+    '''
+
+
+    params = np.asarray(term_params, dtype=np.float64)
+    heights = np.atleast_2d(heights)
+    if static is None:
+        static = static_breakpoints(params)
+    a, b, alpha, beta = params.T
+    if universe is None:
+        universe = (np.min(a - alpha), np.max(b + beta))
+
+    # points where the rising/falling side of term i reaches the clipping height of term j
+    level_rise = (a - alpha)[None, :, None] + heights[:, None, :] * alpha[None, :, None]
+    level_fall = (b + beta)[None, :, None] - heights[:, None, :] * beta[None, :, None]
+    n_samples = heights.shape[0]
+    candidates = np.concatenate([np.broadcast_to(static, (n_samples, len(static))),
+                                 level_rise.reshape(n_samples, -1), level_fall.reshape(n_samples, -1),
+                                 np.broadcast_to(universe, (n_samples, 2))], axis=1)
+    candidates = np.sort(np.clip(candidates, universe[0], universe[1]), axis=1)
+
+    x1, x2 = candidates[:, :-1], candidates[:, 1:]
+    inner = np.stack([x1 + (x2 - x1) / 3.0, x1 + 2.0 * (x2 - x1) / 3.0])
+    values = np.max(np.fmin(trapezoid_membership(inner, params), heights[None, :, None, :]), axis=-1)
+    y1 = np.clip(2.0 * values[0] - values[1], 0.0, 1.0)
+    y2 = np.clip(2.0 * values[1] - values[0], 0.0, 1.0)
+
+    x = np.stack([x1, x2], axis=2).reshape(n_samples, -1)
+    y = np.stack([y1, y2], axis=2).reshape(n_samples, -1)
+    return x, y
+
+
+def defuzzify_exact(term_params, heights, method='centroid', universe=None, static=None):
+    '''
+    Defuzzifies the max-aggregate of clipped trapezoids in closed form, without sampling the consequent range.
+    The cost depends on the number of consequent terms instead of the width of the range.
+
+        Args:
+            term_params(np.array): (n_terms, 4) matrix with the 4-tuple of each consequent term
+            heights(np.array): (N, n_terms) clipping height of each term
+            method(str): 'centroid' or 'bisector' (def: 'centroid')
+            universe(tuple): optional (low, high) bounds the aggregate is restricted to (def: None - the term supports)
+            static(np.array): precomputed static_breakpoints(term_params) (def: None)
+
+        Returns:
+            results(np.array): (N,) defuzzified values (NaN where the aggregated area is zero)
+
+    '''
+
+
+    x, y = aggregate_breakpoints(term_params, heights, universe, static)
+    if method == 'centroid':
+        return defuzzify_centroid_batch(x, y)
+    elif method == 'bisector':
+        return defuzzify_bisector_batch(x, y)
+    raise ValueError('Unknown defuzzification method {}'.format(method))
+
+
+def infer_exact_consequents(kb, measurements, antecedents=None, consequents=None, method='centroid', universe=None):
+    '''
+    Runs grid-free Mamdani inference for a batch of measurement vectors and several consequent variables.
+    The antecedents are fuzzified and the rule strengths computed once for all consequents.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            measurements(np.array): (N, n_antecedents) matrix with one measurement vector per row
+            antecedents(list): the variable name of each measurement column (def: kb.antecedents)
+            consequents(list): the target consequent variables (def: kb.consequents)
+            method(str): 'centroid' or 'bisector' (def: 'centroid')
+            universe(dict): optional (low, high) bounds for each consequent (def: None - the term supports)
+
+        Returns:
+            outputs(dict): (N,) defuzzified values for each consequent
+
+    '''
+
+
+    if consequents is None:
+        consequents = kb.consequents
+    if universe is None:
+        universe = {}
+    strengths = fire_rules_batch(kb, fuzzify_batch(kb, measurements, antecedents))
+
+    outputs = {}
+    for consequent in consequents:
+        heights = consequent_heights(kb, strengths, consequent)
+        outputs[consequent] = defuzzify_exact(kb.term_params[consequent], heights, method, universe.get(consequent))
+
+    return outputs
+
+
+def infer_exact(kb, measurements, antecedents=None, consequent=None, method='centroid', universe=None):
+    '''
+    Runs Mamdani inference for a batch of measurement vectors without any discretized range:
+    the antecedents are fuzzified analytically and the aggregate is defuzzified from its breakpoints.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            measurements(np.array): (N, n_antecedents) matrix with one measurement vector per row
+            antecedents(list): the variable name of each measurement column (def: kb.antecedents)
+            consequent(str): the target consequent variable (def: the last consequent of the knowledge base)
+            method(str): 'centroid' or 'bisector' (def: 'centroid')
+            universe(tuple): optional (low, high) bounds of the consequent (def: None - the term supports)
+
+        Returns:
+            results(np.array): (N,) defuzzified values
+
+    '''
+
+
+    if consequent is None:
+        consequent = kb.consequents[-1]
+    return infer_exact_consequents(kb, measurements, antecedents, [consequent], method,
+                                   {consequent: universe})[consequent]
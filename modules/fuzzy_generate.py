@@ -0,0 +1,162 @@
+import csv
+
+import numpy as np
+
+
+def generate_terms(n_terms, universe=(0.0, 100.0)):
+    '''
+    Lays out evenly spaced trapezoid terms over a universe. Neighbouring terms overlap so that every
+    value belongs to some term, and the first and last terms are shoulders.
+
+        Args:
+            n_terms(int): number of terms
+            universe(tuple): the (low, high) bounds of the variable (def: (0, 100))
+
+        Returns:
+            terms(dict): the 4-tuple (a, b, alpha, beta) of each term, named t1 ... tn
+
+    '''
+
+
+    low, high = universe
+    step = (high - low) / max(n_terms - 1, 1)
+    terms = {}
+    for t in range(n_terms):
+        center = low + t * step
+        alpha = 0.0 if t == 0 else step * 0.75
+        beta = 0.0 if t == n_terms - 1 else step * 0.75
+        terms['t' + str(t + 1)] = [round(center - step / 4, 6) if t > 0 else low,
+                                   round(center + step / 4, 6) if t < n_terms - 1 else high,
+                                   round(alpha, 6), round(beta, 6)]
+    return terms
+
+
+def generate_rules(antecedents, consequents, n_terms, n_rules, n_premises=2, or_ratio=0.0, rng=None):
+    '''
+    Draws random rules over the given variables. The parser supports a single connector per rule,
+    so every rule joins all of its premises with either AND or OR.
+
+        Args:
+            antecedents(list): the antecedent variable names
+            consequents(list): the consequent variable names
+            n_terms(int): number of terms per variable
+            n_rules(int): number of rules
+            n_premises(int or tuple): premises per rule, or a (min, max) range (def: 2)
+            or_ratio(float): share of the rules joined with OR (def: 0.0)
+            rng(np.random.RandomState): the random generator (def: None - unseeded)
+
+        Returns:
+            rule_lines(list): the rule lines, in the knowledge base file syntax
+
+    '''
+
+
+    if rng is None:
+        rng = np.random.RandomState()
+    min_premises, max_premises = (n_premises, n_premises) if np.isscalar(n_premises) else n_premises
+    min_premises = max(1, min(min_premises, len(antecedents)))
+    max_premises = max(min_premises, min(max_premises, len(antecedents)))
+
+    rule_lines = []
+    for r in range(n_rules):
+        premise_vars = list(rng.choice(len(antecedents), rng.randint(min_premises, max_premises + 1), replace=False))
+        if r < len(antecedents) and r not in premise_vars:
+            # the first rules cover every antecedent at least once
+            premise_vars[0] = r
+        connector = ' or ' if rng.uniform() < or_ratio else ' and '
+        premises = connector.join('{} is t{}'.format(antecedents[v], rng.randint(1, n_terms + 1))
+                                  for v in sorted(premise_vars))
+        rule_lines.append('Rule {}: If {} then {} is t{}'.format(r + 1, premises, consequents[r % len(consequents)],
+                                                                rng.randint(1, n_terms + 1)))
+    return rule_lines
+
+
+def generate_measurements(antecedents, n_rows, universe=(0.0, 100.0), rng=None):
+    '''
+    Draws measurement rows uniformly over the universe of every antecedent.
+
+        Args:
+            antecedents(list): the antecedent variable names
+            n_rows(int): number of rows
+            universe(tuple): the (low, high) bounds of the variables (def: (0, 100))
+            rng(np.random.RandomState): the random generator (def: None - unseeded)
+
+        Returns:
+            measurements(np.array): (n_rows, n_antecedents) matrix in antecedents order
+
+    '''
+
+
+    if rng is None:
+        rng = np.random.RandomState()
+    return np.round(rng.uniform(universe[0], universe[1], (n_rows, len(antecedents))), 3)
+
+
+def generate_knowledge_base(n_variables=2, n_terms=5, n_rules=10, n_premises=2, or_ratio=0.0, n_consequents=1,
+                            n_measurements=1, universe=(0.0, 100.0), seed=None):
+    '''
+    Generates a random knowledge base in the .fuzzy file format, for scale testing.
+    Antecedents are named x1 ... xn and consequents y1 ... ym; all variables share the same universe and terms.
+    The file format holds a single set of measurements, so the first measurement row is written into the
+    knowledge base and all rows are returned as a matrix.
+
+        Args:
+            n_variables(int): number of antecedent variables (def: 2)
+            n_terms(int): number of terms per variable (def: 5)
+            n_rules(int): number of rules (def: 10)
+            n_premises(int or tuple): premises per rule, or a (min, max) range (def: 2)
+            or_ratio(float): share of the rules joined with OR (def: 0.0)
+            n_consequents(int): number of consequent variables (def: 1)
+            n_measurements(int): number of measurement rows (def: 1)
+            universe(tuple): the (low, high) bounds of the variables (def: (0, 100))
+            seed(int): seed for reproducible output (def: None)
+
+        Returns:
+            text(str): the knowledge base file content
+            measurements(np.array): (n_measurements, n_variables) matrix of measurement rows
+
+    '''
+
+
+    rng = np.random.RandomState(seed)
+    antecedents = ['x' + str(i + 1) for i in range(n_variables)]
+    consequents = ['y' + str(i + 1) for i in range(n_consequents)]
+    terms = generate_terms(n_terms, universe)
+
+    lines = ['syntheticRulebase', '']
+    lines += generate_rules(antecedents, consequents, n_terms, n_rules, n_premises, or_ratio, rng)
+    for var_name in antecedents + consequents:
+        lines += ['', var_name, '']
+        lines += ['{} {:g} {:g} {:g} {:g}'.format(term_name, *params) for term_name, params in terms.items()]
+    lines.append('')
+
+    measurements = generate_measurements(antecedents, max(n_measurements, 1), universe, rng)
+    lines += ['{} = {:g}'.format(var_name, value) for var_name, value in zip(antecedents, measurements[0])]
+    return '\n'.join(lines) + '\n', measurements[:n_measurements]
+
+
+def write_knowledge_base(file, measurements_file=None, **kwargs):
+    '''
+    Writes a generated knowledge base, and optionally all of its measurement rows as a CSV
+    that can be passed to stream_measurements.py.
+
+        Args:
+            file(str): the output .fuzzy filename
+            measurements_file(str): the output CSV filename for the measurement rows (def: None - not written)
+            kwargs: the generator settings, see generate_knowledge_base
+
+        Returns:
+            measurements(np.array): (n_measurements, n_variables) matrix of measurement rows
+
+    '''
+
+
+    text, measurements = generate_knowledge_base(**kwargs)
+    with open(file, 'w') as fp:
+        fp.write(text)
+    if measurements_file is not None:
+        with open(measurements_file, 'w', newline='') as fp:
+            writer = csv.writer(fp, lineterminator='\n')
+            writer.writerow(['x' + str(i + 1) for i in range(measurements.shape[1])])
+            writer.writerows(measurements.tolist())
+    return measurements
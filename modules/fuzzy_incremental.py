@@ -0,0 +1,140 @@
+import numpy as np
+
+from modules.fuzzy_defuzzifier import defuzzify_bisector_batch, defuzzify_centroid_batch
+from modules.fuzzy_exact_defuzzifier import defuzzify_exact, static_breakpoints
+from modules.fuzzy_inference import aggregate_consequent
+from modules.fuzzy_load import as_knowledge_base
+from modules.fuzzy_membership import trapezoid_membership
+from modules.fuzzy_metrics import count
+
+
+class IncrementalEvaluator:
+    '''
+    Stateful evaluator for streams where every new sample changes only a few antecedents.
+    The last term degrees, rule strengths, clipping heights and outputs are kept between updates:
+    only the terms of the changed variables, the rules that reference them, the heights of the terms
+    those rules conclude and the consequents whose heights moved are recomputed.
+
+        Attributes:
+            kb(KnowledgeBase): the compiled knowledge base
+            consequents(list): the consequents being evaluated
+            variable_rules(list): indices of the rules referencing each variable, in kb.var_names order
+            term_rules(dict): indices of the rules concluding each term, per consequent (in term order)
+
+    '''
+
+
+    def __init__(self, file, consequents=None, method='centroid', universe=None, fuzzy_dict=None, x_ranges=None):
+        '''
+        Builds the dependency index and the empty state.
+
+            Args:
+                file(str or KnowledgeBase): the input knowledge base file name or compiled knowledge base
+                consequents(list): the consequents to evaluate (def: kb.consequents)
+                method(str): 'centroid' or 'bisector' (def: 'centroid')
+                universe(dict): optional (low, high) bounds for each consequent of the exact engine (def: None)
+                fuzzy_dict(dict): membership tables from create_membership_functions (def: None - exact engine)
+                x_ranges(dict): membership ranges from create_membership_functions (def: None - exact engine)
+
+        '''
+
+
+        if method not in ('centroid', 'bisector'):
+            raise ValueError('Unknown defuzzification method {}'.format(method))
+        self.kb = as_knowledge_base(file)
+        self.consequents = list(self.kb.consequents if consequents is None else consequents)
+        self.method = method
+        self._universe = universe or {}
+        self._fuzzy_dict = fuzzy_dict
+        self._x_ranges = x_ranges
+        self._static = {c: static_breakpoints(self.kb.term_params[c]) for c in self.consequents}
+
+        rule_vars = [set(var_idx for var_idx, _ in rule['premises']) for rule in self.kb.compiled_rules]
+        self.variable_rules = [np.array([r for r, var_ids in enumerate(rule_vars) if var_idx in var_ids], dtype=np.intp)
+                               for var_idx in range(len(self.kb.var_names))]
+        self.term_rules = {}
+        for consequent in self.consequents:
+            conseq_rules = self.kb.result_vars == self.kb.var_names.index(consequent)
+            self.term_rules[consequent] = [np.flatnonzero(conseq_rules & (self.kb.result_terms == term_idx))
+                                           for term_idx in range(len(self.kb.term_names[consequent]))]
+        self.reset()
+
+    def reset(self):
+        '''
+        Forgets every measurement, so the next updates start from scratch.
+        '''
+
+
+        self.values = {}
+        self._flat_degrees = np.full(self.kb.n_terms + 2, np.nan)
+        self._flat_degrees[self.kb.n_terms] = 1.0
+        self._flat_degrees[self.kb.n_terms + 1] = 0.0
+        self._strengths = np.full(len(self.kb.compiled_rules), np.nan)
+        self._heights = {c: np.zeros(len(self.kb.term_names[c])) for c in self.consequents}
+        self._outputs = {c: np.nan for c in self.consequents}
+
+    def _defuzzify(self, consequent):
+        heights = self._heights[consequent][None, :]
+        if self._fuzzy_dict is None:
+            return defuzzify_exact(self.kb.term_params[consequent], heights, self.method,
+                                   self._universe.get(consequent), self._static[consequent])[0]
+        conseq_range = self._x_ranges[consequent]
+        aggregated_mfx = aggregate_consequent(self.kb, heights, consequent, self._fuzzy_dict, conseq_range)
+        if self.method == 'bisector':
+            return defuzzify_bisector_batch(conseq_range, aggregated_mfx)[0]
+        return defuzzify_centroid_batch(conseq_range, aggregated_mfx)[0]
+
+    def update(self, inputs):
+        '''
+        Applies new antecedent values and returns the outputs for the current state.
+        Values equal to the previous ones and variables that are not antecedents are ignored.
+
+            Args:
+                inputs(dict): the new value of some antecedents
+
+            Returns:
+                outputs(dict): the defuzzified value of each consequent (NaN until every antecedent has a value,
+                    or where no rule fires)
+
+        '''
+
+
+        changed_vars = []
+        for var_name, value in inputs.items():
+            if var_name in self.kb.antecedents and self.values.get(var_name) != value:
+                self.values[var_name] = value
+                var_idx = self.kb.var_names.index(var_name)
+                offset = self.kb.term_offsets[var_idx]
+                params = self.kb.term_params[var_name]
+                self._flat_degrees[offset:offset + len(params)] = trapezoid_membership(float(value), params)
+                changed_vars.append(var_idx)
+        count('samples')
+        if not changed_vars:
+            return dict(self._outputs)
+
+        rules = np.unique(np.concatenate([self.variable_rules[var_idx] for var_idx in changed_vars]))
+        premise_degrees = self._flat_degrees[self.kb.premise_index[rules]]
+        strengths = np.where(self.kb.rule_is_or[rules], np.max(premise_degrees, axis=1),
+                             np.min(premise_degrees, axis=1))
+        changed_rules = rules[~((strengths == self._strengths[rules]) |
+                                (np.isnan(strengths) & np.isnan(self._strengths[rules])))]
+        self._strengths[rules] = strengths
+        count('rules_evaluated', rules.size)
+
+        complete = len(self.values) == len(self.kb.antecedents)
+        for consequent in self.consequents:
+            conseq_idx = self.kb.var_names.index(consequent)
+            terms = np.unique(self.kb.result_terms[changed_rules[self.kb.result_vars[changed_rules] == conseq_idx]])
+            heights = self._heights[consequent]
+            moved = False
+            for term_idx in terms:
+                height = np.fmax(np.fmax.reduce(self._strengths[self.term_rules[consequent][term_idx]]), 0.0)
+                if height != heights[term_idx]:
+                    heights[term_idx] = height
+                    moved = True
+            if not complete:
+                self._outputs[consequent] = np.nan
+            elif moved or (np.isnan(self._outputs[consequent]) and np.any(heights > 0)):
+                self._outputs[consequent] = self._defuzzify(consequent)
+
+        return dict(self._outputs)
@@ -1,9 +1,9 @@
-import seaborn as sns
 import numpy as np
 
+from modules.fuzzy_defuzzifier import defuzzify_bisector_batch, defuzzify_centroid_batch
 from modules.fuzzy_load import *
-
-sns.set(style='darkgrid', palette="Paired")
+from modules.fuzzy_membership import create_membership_functions, trapezoid_membership
+from modules.fuzzy_metrics import count, metrics_enabled, stage, timed
 
 
 def map_variable_types(measurement_file, fuzzy_variables, var_names, x_ranges, fuzzy_dict):
@@ -11,7 +11,7 @@ def map_variable_types(measurement_file, fuzzy_variables, var_names, x_ranges, f
     Creates a lookup mapping of the current fuzzy variables, which includes their range and type (anticedent or consequent).
     
         Args:
-            measurement_file(str): the input knowledge base file name
+            measurement_file(str or KnowledgeBase): the input knowledge base file name or compiled knowledge base
             fuzzy_variables(dict): the processed fuzzy dictionary with memberships
             var_names(list): lookup list with variable names
             x_ranges(dict): membership ranges for each fuzzy variable
@@ -25,7 +25,10 @@ def map_variable_types(measurement_file, fuzzy_variables, var_names, x_ranges, f
 
 
     var_type_list = []
-    fuzzy_measurements = read_measurements(measurement_file, fuzzy_variables)
+    if isinstance(measurement_file, KnowledgeBase):
+        fuzzy_measurements = dict(measurement_file.measurements)
+    else:
+        fuzzy_measurements = read_measurements(measurement_file, fuzzy_variables)
 
     for var_name in var_names:
         var_type_dict = {}
@@ -52,14 +55,92 @@ def map_variable_types(measurement_file, fuzzy_variables, var_names, x_ranges, f
     return var_type_list, fuzzy_measurements
 
 
+def fuzzify(fuzzy_dict, fuzzy_measurements, x_ranges):
+    '''
+    Computes the membership degree of every term of the measured variables.
+    The results are kept in a new dictionary and the membership tables are left untouched.
+
+        Args:
+            fuzzy_dict(dict): the processed fuzzy variable dictionary with assigned memberships
+            fuzzy_measurements(dict): the measurements dictionary
+            x_ranges(dict): membership ranges for each fuzzy variable
+
+        Returns:
+            degrees(dict): the membership degree of each term, grouped by variable
+
+    '''
+
+
+    degrees = {}
+    for k, v in fuzzy_dict.items():
+        if k in fuzzy_measurements:
+            degrees[k] = {}
+            for k_j, v_j in v.items():
+                degrees[k][k_j] = np.interp(fuzzy_measurements[k], x_ranges[k], v_j, left=0, right=0)
+
+    return degrees
+
+
+@timed('fuzzify')
+def fuzzify_analytic(fuzzy_vars, fuzzy_measurements):
+    '''
+    Computes the membership degree of every term of the measured variables in closed form,
+    directly from the 4-tuple parameters instead of interpolating the discretized membership functions.
+
+        Args:
+            fuzzy_vars(dict): the parsed fuzzy variable dictionary with the 4-tuple representations
+            fuzzy_measurements(dict): the measurements dictionary
+
+        Returns:
+            degrees(dict): the membership degree of each term, grouped by variable
+
+    '''
+
+
+    degrees = {}
+    for k, v in fuzzy_vars.items():
+        if k in fuzzy_measurements:
+            term_degrees = trapezoid_membership(fuzzy_measurements[k], list(v.values()))
+            degrees[k] = dict(zip(v.keys(), term_degrees))
+
+    return degrees
+
+
+def term_support_slices(fuzzy_sets, x_range):
+    '''
+    Looks up the slice of a sampled range outside of which each term of a variable is zero,
+    i.e. the samples within [a - alpha, b + beta]. Clipping and aggregating a term only inside its slice
+    gives the same result as working over the whole range.
+
+        Args:
+            fuzzy_sets(dict): the 4-tuple representation of each term of the variable
+            x_range(np.array): the sorted range of values of the variable
+
+        Returns:
+            supports(dict): the support slice of each term
+
+    '''
+
+
+    supports = {}
+    for term_name, (a, b, alpha, beta) in fuzzy_sets.items():
+        supports[term_name] = slice(int(np.searchsorted(x_range, a - alpha, side='left')),
+                                    int(np.searchsorted(x_range, b + beta, side='right')))
+    return supports
+
+
 def infer_rules(file, fuzzy_vars, fuzzy_dict, fuzzy_measurements, x_ranges):
     '''
     Creates activations for each fuzzy rule, based on the Mamdani inference principles.
     The areas of activation are then aggregated using max-min composition.
-    Can handle simple rules with 1 (SIMPLE) or 2 (AND, OR) conditions.
+    Can handle rules with any number of conditions, joined by AND or OR.
+    The antecedent degrees are evaluated in closed form from fuzzy_vars and the membership tables
+    in fuzzy_dict are only read, so they can be reused for further inferences.
+    Rules with a zero firing strength are left out of activation_dict, and the result term of the others
+    is only clipped within its support.
 
         Args:
-            file(str): the input knowledge base file name
+            file(str or KnowledgeBase): the input knowledge base file name or compiled knowledge base
             fuzzy_vars(dict): the processed fuzzy dictionary with memberships
             fuzzy_dict(dict): the original parsed fuzzy variable dictionary
             fuzzy_measurements(dict): the original parsed measurements dictionary
@@ -71,43 +152,341 @@ def infer_rules(file, fuzzy_vars, fuzzy_dict, fuzzy_measurements, x_ranges):
     '''
 
 
-    anticedent_keys = list(fuzzy_measurements.keys())
-    for k, v in fuzzy_dict.items():
-        if str(k) in anticedent_keys:
-            for k_j, v_j in v.items():
-                cur_interp = np.interp(fuzzy_measurements[k], x_ranges[k], v[k_j], left=0, right=0)
-                v[k_j] = cur_interp
+    degrees = fuzzify_analytic(fuzzy_vars, fuzzy_measurements)
 
-    fuzzy_rules = read_rulebase(file, fuzzy_vars)
+    if isinstance(file, KnowledgeBase):
+        fuzzy_rules = file.rules
+    else:
+        fuzzy_rules = read_rulebase(file, fuzzy_vars)
     activation_dict = {}
+    supports = {}
     idx = 1
-    for rule in fuzzy_rules:
+    with stage('fire_rules'):
+        for rule in fuzzy_rules:
 
-        cur_condition = rule['precedents']
-        cur_result = rule['result']
-        result_membership = fuzzy_dict[list(cur_result.keys())[0]][list(cur_result.values())[0]]
+            cur_condition = rule['precedents']
+            result_var, result_term = list(rule['result'].items())[0]
 
-        if rule['connector'] == 'SIMPLE':
-            precedent_membership = fuzzy_dict[list(cur_condition.keys())[0]][list(cur_condition.values())[0]]
-            activation = np.fmin(precedent_membership, result_membership)
-            activation_dict['R' + str(idx)] = activation
-            idx += 1
+            premise_memberships = [degrees[k][v] for k, v in cur_condition.items()]
+            if rule['connector'] == 'OR':
+                rule_activation = np.max(premise_memberships)
+            else:
+                rule_activation = np.min(premise_memberships)
 
-        else:
-            # can handle rules with 2 conditions
-            if len(cur_condition) == 2:
-                precedent_membership_i = fuzzy_dict[list(cur_condition.keys())[0]][list(cur_condition.values())[0]]
-                precedent_membership_j = fuzzy_dict[list(cur_condition.keys())[1]][list(cur_condition.values())[1]]
-                if rule['connector'] == 'AND':
-                    rule_activation = np.fmin(precedent_membership_i, precedent_membership_j)
-                elif rule['connector'] == 'OR':
-                    rule_activation = np.fmax(precedent_membership_i, precedent_membership_j)
-
-                activation = np.fmin(rule_activation, result_membership)
+            if rule_activation > 0:
+                if result_var not in supports:
+                    supports[result_var] = term_support_slices(fuzzy_vars[result_var], x_ranges[result_var])
+                support = supports[result_var][result_term]
+                result_membership = fuzzy_dict[result_var][result_term]
+                scale = getattr(fuzzy_dict[result_var], 'scale', 1.0)
+                activation = np.zeros(result_membership.shape)
+                activation[support] = np.fmin(rule_activation, result_membership[support] * scale)
                 activation_dict['R' + str(idx)] = activation
-                idx += 1
-            else:
-                print('Invalid condition count')
-                return
+            idx += 1
+
+    if metrics_enabled():
+        count('rules_evaluated', len(fuzzy_rules))
+        count('rules_fired', len(activation_dict))
 
     return activation_dict
+
+
+@timed('fuzzify')
+def fuzzify_batch(kb, measurements, antecedents=None):
+    '''
+    Computes the membership degree of every antecedent term for a batch of measurement vectors.
+    The degrees are evaluated in closed form from the term parameters, so the antecedent ranges are not needed.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            measurements(np.array): (N, n_antecedents) matrix with one measurement vector per row
+            antecedents(list): the variable name of each measurement column (def: kb.antecedents)
+
+        Returns:
+            degrees(list): (N, n_terms) membership degrees for each variable index, None if it was not measured
+
+    '''
+
+
+    if antecedents is None:
+        antecedents = kb.antecedents
+    measurements = np.atleast_2d(np.asarray(measurements, dtype=np.float64))
+    if measurements.shape[1] != len(antecedents):
+        raise ValueError('Expected {} measurement columns, got {}'.format(len(antecedents), measurements.shape[1]))
+
+    degrees = [None] * len(kb.var_names)
+    for col, var_name in enumerate(antecedents):
+        degrees[kb.var_names.index(var_name)] = trapezoid_membership(measurements[:, col], kb.term_params[var_name])
+
+    count('samples', measurements.shape[0])
+    return degrees
+
+
+def flatten_degrees(kb, degrees):
+    '''
+    Lays the per-variable membership degrees out in the flat term layout of the knowledge base,
+    followed by the constant 1 and 0 columns used to pad the rule matrix.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            degrees(list): per-variable membership degrees, as returned by fuzzify_batch
+
+        Returns:
+            flat_degrees(np.array): (N, n_terms + 2) matrix of membership degrees (NaN for unmeasured variables)
+
+    '''
+
+
+    for var_name in kb.antecedents:
+        if degrees[kb.var_names.index(var_name)] is None:
+            raise ValueError('Missing measurements for antecedent {}'.format(var_name))
+
+    n_samples = next(d.shape[0] for d in degrees if d is not None)
+    flat_degrees = np.full((n_samples, kb.n_terms + 2), np.nan)
+    for var_idx, var_degrees in enumerate(degrees):
+        if var_degrees is not None:
+            offset = kb.term_offsets[var_idx]
+            flat_degrees[:, offset:offset + var_degrees.shape[1]] = var_degrees
+    flat_degrees[:, kb.n_terms] = 1.0
+    flat_degrees[:, kb.n_terms + 1] = 0.0
+    return flat_degrees
+
+
+@timed('fire_rules')
+def fire_rules_batch(kb, degrees, block_size=2 ** 22):
+    '''
+    Computes the firing strength of every rule for a batch of fuzzified measurements.
+    The premise degrees of all rules are gathered through the rule matrix of the knowledge base
+    and reduced with min (AND) or max (OR), so rules can have any number of premises.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            degrees(list): per-variable membership degrees, as returned by fuzzify_batch
+            block_size(int): maximum number of gathered premise degrees held in memory at once (def: 2 ** 22)
+
+        Returns:
+            strengths(np.array): (N, n_rules) matrix of rule firing strengths
+
+    '''
+
+
+    flat_degrees = flatten_degrees(kb, degrees)
+    n_samples = flat_degrees.shape[0]
+    n_rules, n_premises = kb.premise_index.shape
+    strengths = np.empty((n_samples, n_rules))
+    rows_per_block = max(1, block_size // max(1, n_rules * n_premises))
+    for start in range(0, n_samples, rows_per_block):
+        premise_degrees = flat_degrees[start:start + rows_per_block, kb.premise_index]
+        block = strengths[start:start + rows_per_block]
+        block[:, ~kb.rule_is_or] = np.min(premise_degrees[:, ~kb.rule_is_or], axis=2)
+        block[:, kb.rule_is_or] = np.max(premise_degrees[:, kb.rule_is_or], axis=2)
+
+    if metrics_enabled():
+        count('rules_evaluated', strengths.size)
+        count('rules_fired', int(np.count_nonzero(strengths > 0)))
+    return strengths
+
+
+@timed('aggregate')
+def consequent_heights(kb, strengths, consequent):
+    '''
+    Computes the height each consequent term is clipped at, i.e. the maximum firing strength
+    over the rules that conclude it. Clipping a term once at this height gives the same
+    max-min aggregate as clipping it for every rule.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            strengths(np.array): (N, n_rules) matrix of rule firing strengths
+            consequent(str): the target consequent variable
+
+        Returns:
+            heights(np.array): (N, n_terms) clipping height of each term of the consequent
+
+    '''
+
+
+    conseq_rules = kb.result_vars == kb.var_names.index(consequent)
+    heights = np.zeros((strengths.shape[0], len(kb.term_names[consequent])))
+    for term_idx in range(heights.shape[1]):
+        term_rules = conseq_rules & (kb.result_terms == term_idx)
+        if np.any(term_rules):
+            heights[:, term_idx] = np.fmax(np.fmax.reduce(strengths[:, term_rules], axis=1), 0.0)
+
+    return heights
+
+
+@timed('aggregate')
+def aggregate_consequent(kb, heights, consequent, fuzzy_dict, x_range=None):
+    '''
+    Clips the sampled consequent terms at their heights and aggregates them with max composition.
+    Only the rows where a term is active are updated, and only within the support slice of the term
+    if the consequent range is given. Packed tables (see create_membership_functions) are aggregated in their
+    own storage type, so float32 and fixed-point tables move less memory.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            heights(np.array): (N, n_terms) clipping height of each term of the consequent
+            consequent(str): the consequent variable
+            fuzzy_dict(dict): the processed fuzzy variable dictionary with assigned memberships
+            x_range(np.array): the range of values of the consequent (def: None - aggregate over the whole range)
+
+        Returns:
+            aggregated_mfx(np.array): (N, grid) aggregated activation functions (float32 for packed tables
+                other than float64)
+
+    '''
+
+
+    term_memberships = fuzzy_dict[consequent]
+    scale = getattr(term_memberships, 'scale', 1.0)
+    first_membership = term_memberships[kb.term_names[consequent][0]]
+    if np.issubdtype(first_membership.dtype, np.integer):
+        heights = np.round(heights / scale).astype(first_membership.dtype)
+    else:
+        heights = heights.astype(first_membership.dtype, copy=False)
+    aggregated_mfx = np.zeros((heights.shape[0], len(first_membership)), dtype=first_membership.dtype)
+    if x_range is not None:
+        supports = term_support_slices(kb.variables[consequent], x_range)
+    for term_idx, term_name in enumerate(kb.term_names[consequent]):
+        active = np.flatnonzero(heights[:, term_idx] > 0)
+        if active.size == 0:
+            continue
+        support = supports[term_name] if x_range is not None else slice(None)
+        membership = term_memberships[term_name][support]
+        if active.size == heights.shape[0]:
+            window = aggregated_mfx[:, support]
+            np.fmax(window, np.fmin(heights[:, term_idx, None], membership), out=window)
+        else:
+            aggregated_mfx[active, support] = np.fmax(aggregated_mfx[active, support],
+                                                      np.fmin(heights[active, term_idx, None], membership))
+
+    if scale != 1.0:
+        aggregated_mfx = aggregated_mfx * np.float32(scale)
+
+    return aggregated_mfx
+
+
+def infer_batch_consequents(kb, measurements, fuzzy_dict, x_ranges, antecedents=None, consequents=None):
+    '''
+    Runs Mamdani inference for a batch of measurement vectors and several consequent variables.
+    The antecedents are fuzzified and the rule strengths computed once; only the aggregation
+    and centroid defuzzification are repeated for every consequent.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            measurements(np.array): (N, n_antecedents) matrix with one measurement vector per row
+            fuzzy_dict(dict): the processed fuzzy variable dictionary (only the consequent memberships are used)
+            x_ranges(dict): membership ranges for each fuzzy variable (only the consequent ranges are used)
+            antecedents(list): the variable name of each measurement column (def: kb.antecedents)
+            consequents(list): the target consequent variables (def: kb.consequents)
+
+        Returns:
+            outputs(dict): (results, conseq_range, aggregated_mfx) for each consequent, as returned by infer_batch
+
+    '''
+
+
+    if consequents is None:
+        consequents = kb.consequents
+    strengths = fire_rules_batch(kb, fuzzify_batch(kb, measurements, antecedents))
+
+    outputs = {}
+    for consequent in consequents:
+        heights = consequent_heights(kb, strengths, consequent)
+        aggregated_mfx = aggregate_consequent(kb, heights, consequent, fuzzy_dict, x_ranges[consequent])
+        results = defuzzify_centroid_batch(x_ranges[consequent], aggregated_mfx)
+        outputs[consequent] = (results, x_ranges[consequent], aggregated_mfx)
+
+    return outputs
+
+
+def infer_batch(kb, measurements, fuzzy_dict, x_ranges, antecedents=None, consequent=None):
+    '''
+    Runs Mamdani inference for a batch of measurement vectors.
+    The consequent terms are clipped by the rule firing strengths and aggregated with max composition
+    for all rows at once, then defuzzified with the centroid method.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            measurements(np.array): (N, n_antecedents) matrix with one measurement vector per row
+            fuzzy_dict(dict): the processed fuzzy variable dictionary (only the consequent memberships are used)
+            x_ranges(dict): membership ranges for each fuzzy variable (only the consequent range is used)
+            antecedents(list): the variable name of each measurement column (def: kb.antecedents)
+            consequent(str): the target consequent variable (def: the last consequent of the knowledge base)
+
+        Returns:
+            results(np.array): (N,) centroid defuzzified values
+            conseq_range(np.array): the range of possible values for the consequent variable
+            aggregated_mfx(np.array): (N, grid) aggregated activation functions
+
+    '''
+
+
+    if consequent is None:
+        consequent = kb.consequents[-1]
+    return infer_batch_consequents(kb, measurements, fuzzy_dict, x_ranges, antecedents, [consequent])[consequent]
+
+
+def table_accuracy_report(kb, dtypes=('float32', 'uint16', 'uint8'), n_samples=10000, seed=0, resolution=0.1,
+                          adaptive=None, method='centroid'):
+    '''
+    Measures the memory and accuracy of packed membership tables against the float64 tables,
+    on the membership degrees and on the batch engine outputs at uniformly sampled measurements.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            dtypes(list): the table types to compare (def: ('float32', 'uint16', 'uint8'))
+            n_samples(int): number of random test points (def: 10000)
+            seed(int): seed of the random test points (def: 0)
+            resolution(float or dict): the sampling step of the tables (def: 0.1)
+            adaptive(float or dict): coarse step for adaptive sampling around the breakpoints (def: None)
+            method(str): 'centroid' or 'bisector' (def: 'centroid')
+
+        Returns:
+            report(dict): for every type, the table size in bytes, its ratio to float64 (compression),
+                the maximum degree error, and the max, mean, 99th percentile and RMS absolute output error
+                and the share of points where only one of the two results is defined (nan_mismatch)
+
+    '''
+
+
+    rng = np.random.RandomState(seed)
+    measurements = np.column_stack([rng.uniform(np.min(kb.term_params[v][:, 0] - kb.term_params[v][:, 2]),
+                                                np.max(kb.term_params[v][:, 1] + kb.term_params[v][:, 3]), n_samples)
+                                    for v in kb.antecedents])
+
+    def evaluate(fuzzy_dict, x_ranges):
+        outputs = infer_batch_consequents(kb, measurements, fuzzy_dict, x_ranges)
+        if method == 'bisector':
+            return {c: defuzzify_bisector_batch(r[1], r[2]) for c, r in outputs.items()}
+        return {c: r[0] for c, r in outputs.items()}
+
+    reference_dict, x_ranges, _, _ = create_membership_functions(kb, var_subset=kb.consequents,
+                                                                 resolution=resolution, adaptive=adaptive)
+    reference_bytes = sum(m.nbytes for v in reference_dict.values() for m in v.values())
+    expected = evaluate(reference_dict, x_ranges)
+
+    report = {}
+    for dtype in dtypes:
+        fuzzy_dict, _, _, _ = create_membership_functions(kb, var_subset=kb.consequents, resolution=resolution,
+                                                          adaptive=adaptive, dtype=dtype)
+        table_bytes = sum(table.values.nbytes for table in fuzzy_dict.values())
+        degree_error = max(float(np.max(np.abs(table.values * table.scale -
+                                               np.vstack(list(reference_dict[var_name].values())))))
+                           for var_name, table in fuzzy_dict.items())
+        actual = evaluate(fuzzy_dict, x_ranges)
+
+        expected_all = np.concatenate([expected[c] for c in kb.consequents])
+        actual_all = np.concatenate([actual[c] for c in kb.consequents])
+        defined = np.isfinite(expected_all) & np.isfinite(actual_all)
+        error = np.abs(expected_all[defined] - actual_all[defined])
+        if len(error) == 0:
+            error = np.array([np.nan])
+        report[dtype] = {'bytes': table_bytes, 'compression': reference_bytes / table_bytes,
+                         'max_degree_error': degree_error,
+                         'max_abs_error': float(np.max(error)),
+                         'mean_abs_error': float(np.mean(error)),
+                         'p99_abs_error': float(np.percentile(error, 99)),
+                         'rmse': float(np.sqrt(np.mean(error ** 2))),
+                         'nan_mismatch': float(np.mean(np.isfinite(expected_all) != np.isfinite(actual_all)))}
+    return report
@@ -1,6 +1,13 @@
+import io
 import re
 import numpy as np
 
+from modules.fuzzy_metrics import stage
+
+# bump whenever a parser change alters the parsed knowledge base, so compiled caches are rebuilt
+PARSER_VERSION = 1
+
+
 def read_variables(file):
     '''
     Parses the input fuzzy variables from the knowledge base into a dictionary. 
@@ -15,29 +22,45 @@ def read_variables(file):
 
 
     with open(file) as fp:
-        line = fp.readline()
-        fuzzy_vars = {}
-        while line:
-            text = line.strip()
-            text = str.split(text, " ")
-            if len(text) == 1 and 'Rule' not in text[0] and text[0] != '':
-                fuzzy_categories = {}
-                var_name = text[0]
-                fp.readline()
+        return parse_variables(fp)
+
+
+def parse_variables(fp):
+    '''
+    Parses the fuzzy variables from an already opened knowledge base stream.
+
+        Args:
+            fp(file): the input stream, read line by line
+
+        Returns:
+            fuzzy_vars(dict): the dictionary of variables along with their 4-tuple representations.
+
+    '''
+
+
+    line = fp.readline()
+    fuzzy_vars = {}
+    while line:
+        text = line.strip()
+        text = str.split(text, " ")
+        if len(text) == 1 and 'Rule' not in text[0] and text[0] != '':
+            fuzzy_categories = {}
+            var_name = text[0]
+            fp.readline()
+            line_cat = fp.readline()
+            while len(line_cat.strip()) > 0:
+                category = line_cat.strip()
+                category_values = str.split(category, ' ')
+                cat_name = category_values[0].strip()
+                fuzzy_set = [float(category_values[1]), float(category_values[2]), float(category_values[3]),
+                             float(category_values[4])]
+                fuzzy_categories[str(cat_name).strip()] = eval(str(fuzzy_set))
                 line_cat = fp.readline()
-                while len(line_cat.strip()) > 0:
-                    category = line_cat.strip()
-                    category_values = str.split(category, ' ')
-                    cat_name = category_values[0].strip()
-                    fuzzy_set = [float(category_values[1]), float(category_values[2]), float(category_values[3]),
-                                 float(category_values[4])]
-                    fuzzy_categories[str(cat_name).strip()] = eval(str(fuzzy_set))
-                    line_cat = fp.readline()
 
-                if len(fuzzy_categories) > 0:
-                    fuzzy_vars[str(var_name)] = fuzzy_categories
-            line = fp.readline()
-        return fuzzy_vars
+            if len(fuzzy_categories) > 0:
+                fuzzy_vars[str(var_name)] = fuzzy_categories
+        line = fp.readline()
+    return fuzzy_vars
 
 
 def read_rulebase(file, fuzzy_vars):
@@ -55,61 +78,78 @@ def read_rulebase(file, fuzzy_vars):
 
 
     with open(file) as fp:
-        line = fp.readline()
-        fuzzy_rules = []
-        while line != "":
-            if ':' in line:
-                rule_text = str.split(line, ':')[1]
-                if rule_text != "" and 'then' in rule_text:
-                    precedent, result = str.split(rule_text, 'then')
-                    fuzzy_rules_dict = {}
-                    res_dict = {}
-                    req_dict = {}
-                    connector = 'SIMPLE'
-                    if ' and ' in precedent:
-                        connector = 'AND'
-                        precedents = str.split(precedent, ' and ')
-                    elif ' or ' in precedent:
-                        connector = 'OR'
-                        precedents = str.split(precedent, ' or ')
-                    else:
-                        precedents = precedent
-
-                    for i in range(len(precedents)):
-                        if i == 0:
-                            if not isinstance(precedents, list):
-                                precedents = str.split(precedents, 'If')[1]
-                                match = re.search(r'(.*) is (.*)', precedents)
-                                if match:
-                                    if (match.groups()[0] and match.groups()[1]) is not None and match.groups()[
-                                        0].strip() in fuzzy_vars:
-                                        req = match.groups()[0].strip()
-                                        outcome = match.groups()[1].strip()
-                                        req_dict[str(req)] = outcome
-                                break
-
-                        match = re.search(r'(.*) is (.*)', precedents[i])
-                        if match:
-                            if (match.groups()[0] and match.groups()[1]) is not None:
-                                if 'If' in match.groups()[0].strip():
-                                    req = str.split(match.groups()[0].strip(), ' ')[1]
-                                else:
+        return parse_rulebase(fp, fuzzy_vars)
+
+
+def parse_rulebase(fp, fuzzy_vars):
+    '''
+    Parses the fuzzy rulebase from an already opened knowledge base stream.
+
+        Args:
+            fp(file): the input stream, read line by line
+            fuzzy_vars(dict): the fuzzy variable dictionary
+
+        Returns:
+            fuzzy_rules(list): the output list of rule objects
+
+    '''
+
+
+    line = fp.readline()
+    fuzzy_rules = []
+    while line != "":
+        if ':' in line:
+            rule_text = str.split(line, ':')[1]
+            if rule_text != "" and 'then' in rule_text:
+                precedent, result = str.split(rule_text, 'then')
+                fuzzy_rules_dict = {}
+                res_dict = {}
+                req_dict = {}
+                connector = 'SIMPLE'
+                if ' and ' in precedent:
+                    connector = 'AND'
+                    precedents = str.split(precedent, ' and ')
+                elif ' or ' in precedent:
+                    connector = 'OR'
+                    precedents = str.split(precedent, ' or ')
+                else:
+                    precedents = precedent
+
+                for i in range(len(precedents)):
+                    if i == 0:
+                        if not isinstance(precedents, list):
+                            precedents = str.split(precedents, 'If')[1]
+                            match = re.search(r'(.*) is (.*)', precedents)
+                            if match:
+                                if (match.groups()[0] and match.groups()[1]) is not None and match.groups()[
+                                    0].strip() in fuzzy_vars:
                                     req = match.groups()[0].strip()
-                                outcome = match.groups()[1].strip()
-                                req_dict[str(req)] = outcome
+                                    outcome = match.groups()[1].strip()
+                                    req_dict[str(req)] = outcome
+                            break
+
+                    match = re.search(r'(.*) is (.*)', precedents[i])
+                    if match:
+                        if (match.groups()[0] and match.groups()[1]) is not None:
+                            if 'If' in match.groups()[0].strip():
+                                req = str.split(match.groups()[0].strip(), ' ')[1]
+                            else:
+                                req = match.groups()[0].strip()
+                            outcome = match.groups()[1].strip()
+                            req_dict[str(req)] = outcome
 
-                    result_lhs, result_rhs = str.split(result, 'is')
-                    if (result_lhs and result_rhs) is not None and result_lhs.strip() in fuzzy_vars:
-                        res_dict[str(result_lhs).strip()] = result_rhs.strip()
+                result_lhs, result_rhs = str.split(result, 'is')
+                if (result_lhs and result_rhs) is not None and result_lhs.strip() in fuzzy_vars:
+                    res_dict[str(result_lhs).strip()] = result_rhs.strip()
 
-                    fuzzy_rules_dict['precedents'] = req_dict
-                    fuzzy_rules_dict['connector'] = connector
-                    fuzzy_rules_dict['result'] = res_dict
-                    fuzzy_rules.append(fuzzy_rules_dict)
+                fuzzy_rules_dict['precedents'] = req_dict
+                fuzzy_rules_dict['connector'] = connector
+                fuzzy_rules_dict['result'] = res_dict
+                fuzzy_rules.append(fuzzy_rules_dict)
 
-            line = fp.readline()
+        line = fp.readline()
 
-        return fuzzy_rules
+    return fuzzy_rules
 
 
 def read_measurements(file, fuzzy_vars):
@@ -127,15 +167,187 @@ def read_measurements(file, fuzzy_vars):
 
 
     with open(file) as fp:
+        return parse_measurements(fp, fuzzy_vars)
+
+
+def parse_measurements(fp, fuzzy_vars):
+    '''
+    Parses the fuzzy measurements from an already opened knowledge base stream.
+
+        Args:
+            fp(file): the input stream, read line by line
+            fuzzy_vars(dict): the fuzzy variable dictionary
+
+        Returns:
+            fuzzy_measurement_dict(dict): the output measurements dictionary
+
+    '''
+
+
+    line = fp.readline()
+    fuzzy_measurement_dict = {}
+    while line:
+        if '=' in line:
+            variable, result = str.split(line, '=')
+            if variable.strip() in fuzzy_vars:
+                fuzzy_measurement_dict[str(variable).strip()] = np.float32(result.strip())
         line = fp.readline()
-        fuzzy_measurement_dict = {}
-        while line:
-            if '=' in line:
-                variable, result = str.split(line, '=')
-                if variable.strip() in fuzzy_vars:
-                    fuzzy_measurement_dict[str(variable).strip()] = np.float32(result.strip())
-            line = fp.readline()
-        return fuzzy_measurement_dict
+    return fuzzy_measurement_dict
+
+
+class KnowledgeBase:
+    '''
+    Compiled in-memory knowledge base. The source file is read once and the variables, rules and
+    measurements are parsed from the same buffer, so it can be shared between any number of inferences.
+
+        Attributes:
+            name(str): the source filename (or None when built from text)
+            variables(dict): the dictionary of variables along with their 4-tuple representations
+            rules(list): the list of rule objects, as returned by read_rulebase
+            measurements(dict): the measurements dictionary, as returned by read_measurements
+            var_names(list): lookup list with variable names (in file order)
+            term_names(dict): lookup list with the term names of each variable (in file order)
+            term_params(dict): (n_terms, 4) matrix with the 4-tuples of each variable (in term order)
+            antecedents(list): names of the variables used as rule premises
+            consequents(list): names of the variables used as rule results
+            compiled_rules(list): rules with integer indices, each a dictionary of
+                premises(list of (var_idx, term_idx)), connector(str) and result((var_idx, term_idx))
+            term_offsets(list): column of the first term of each variable in the flat term layout,
+                where the terms of all variables are laid out one after another
+            n_terms(int): total number of terms; columns n_terms and n_terms + 1 hold the constants 1 and 0
+            premise_index(np.array): (n_rules, max_premises) flat term column of every rule premise,
+                padded with the constant column that is neutral for the rule connector
+            rule_is_or(np.array): (n_rules,) True for the rules whose premises are combined with OR
+            result_vars(np.array): (n_rules,) variable index of every rule result
+            result_terms(np.array): (n_rules,) term index of every rule result
+
+    '''
+
+
+    def __init__(self, text, name=None):
+        self.name = name
+        with stage('parse'):
+            self.variables = parse_variables(io.StringIO(text))
+            self.rules = parse_rulebase(io.StringIO(text), self.variables)
+            self.measurements = parse_measurements(io.StringIO(text), self.variables)
+
+        self.var_names = list(self.variables.keys())
+        self.term_names = {}
+        self.term_params = {}
+        for k, v in self.variables.items():
+            self.term_names[k] = list(v.keys())
+            self.term_params[k] = np.array(list(v.values()), dtype=np.float64)
+
+        self.compiled_rules = self._compile_rules()
+        self._compile_rule_matrix()
+        self.antecedents = []
+        self.consequents = []
+        for var_idx, var_name in enumerate(self.var_names):
+            if any(var_idx == p[0] for rule in self.compiled_rules for p in rule['premises']):
+                self.antecedents.append(var_name)
+            elif any(var_idx == rule['result'][0] for rule in self.compiled_rules):
+                self.consequents.append(var_name)
+
+    def _compile_rules(self):
+        '''
+        Translates the variable and term names of each rule into integer indices.
+
+            Returns:
+                compiled_rules(list): the list of index-based rule objects
+
+        '''
+
+
+        compiled_rules = []
+        for idx, rule in enumerate(self.rules):
+            premises = []
+            for k, v in rule['precedents'].items():
+                premises.append(self.term_index(k, v, idx))
+            if len(premises) == 0 or len(rule['result']) != 1:
+                raise ValueError('Rule {} has no valid premise or result'.format(idx + 1))
+            result_var, result_term = list(rule['result'].items())[0]
+            compiled_rules.append({'premises': premises,
+                                   'connector': rule['connector'],
+                                   'result': self.term_index(result_var, result_term, idx)})
+        return compiled_rules
+
+    def _compile_rule_matrix(self):
+        '''
+        Lays the compiled rules out as index arrays, so the firing strengths of all rules
+        can be computed with one gather and one min/max reduction regardless of the premise count.
+
+        '''
+
+
+        self.term_offsets = list(np.cumsum([0] + [len(self.term_names[k]) for k in self.var_names])[:-1])
+        self.n_terms = sum(len(v) for v in self.term_names.values())
+        n_premises = max([len(rule['premises']) for rule in self.compiled_rules] + [1])
+
+        self.rule_is_or = np.array([rule['connector'] == 'OR' for rule in self.compiled_rules], dtype=bool)
+        # AND rules are padded with the constant 1 column and OR rules with the constant 0 column
+        self.premise_index = np.where(self.rule_is_or[:, None], self.n_terms + 1, self.n_terms)
+        self.premise_index = np.broadcast_to(self.premise_index, (len(self.compiled_rules), n_premises)).copy()
+        for rule_idx, rule in enumerate(self.compiled_rules):
+            for premise_idx, (var_idx, term_idx) in enumerate(rule['premises']):
+                self.premise_index[rule_idx, premise_idx] = self.term_offsets[var_idx] + term_idx
+
+        self.result_vars = np.array([rule['result'][0] for rule in self.compiled_rules], dtype=np.intp)
+        self.result_terms = np.array([rule['result'][1] for rule in self.compiled_rules], dtype=np.intp)
+
+    def term_index(self, var_name, term_name, rule_idx=None):
+        '''
+        Looks up the (variable, term) index pair of a fuzzy term.
+
+            Args:
+                var_name(str): the variable name
+                term_name(str): the term name
+                rule_idx(int): index of the rule being compiled, used for error reporting (def: None)
+
+            Returns:
+                (var_idx, term_idx)(tuple): the integer indices of the variable and its term
+
+        '''
+
+
+        if var_name not in self.variables or term_name not in self.variables[var_name]:
+            location = '' if rule_idx is None else ' in rule {}'.format(rule_idx + 1)
+            raise ValueError('Unknown fuzzy term {} is {}{}'.format(var_name, term_name, location))
+        return self.var_names.index(var_name), self.term_names[var_name].index(term_name)
+
+
+def load_knowledge_base(file):
+    '''
+    Reads a knowledge base file once and parses it into a KnowledgeBase object.
+
+        Args:
+            file(str): the input filename
+
+        Returns:
+            kb(KnowledgeBase): the compiled knowledge base
+
+    '''
+
+
+    with open(file) as fp:
+        return KnowledgeBase(fp.read(), name=file)
+
+
+def as_knowledge_base(file):
+    '''
+    Returns the argument unchanged if it is already a KnowledgeBase, otherwise loads it from file.
+
+        Args:
+            file(str or KnowledgeBase): the input filename or compiled knowledge base
+
+        Returns:
+            kb(KnowledgeBase): the compiled knowledge base
+
+    '''
+
+
+    if isinstance(file, KnowledgeBase):
+        return file
+    return load_knowledge_base(file)
 
 '''
 fuzzy_variables = read_variables('dv.fuzzy')
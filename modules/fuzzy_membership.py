@@ -1,19 +1,105 @@
-import seaborn as sns
-import matplotlib.pyplot as plt
-
 from modules.fuzzy_load import *
+from modules.fuzzy_plot import import_plotting
+
+
+def create_universe(fuzzy_sets, resolution=0.1, adaptive=None):
+    '''
+    Generates the discrete range of values of a fuzzy variable, spanning the supports of its terms.
+    In adaptive mode the range is sampled with a coarse step and the fine resolution is only used
+    within one coarse step of each trapezoid breakpoint, where the memberships change slope.
+
+        Args:
+            fuzzy_sets(list): the 4-tuple representations of the variable terms
+            resolution(float): the sampling step (def. 0.1)
+            adaptive(float): the coarse step used away from the breakpoints (def. None - uniform sampling)
+
+        Returns:
+            x_range(np.array): the sorted range of values
+
+    '''
+
+
+    params = np.asarray(fuzzy_sets, dtype=np.float64)
+    min_range = np.min(params[:, 0] - params[:, 2])
+    max_range = max(np.max(params[:, 1] + params[:, 3]), min_range)
+    if adaptive is None:
+        return np.arange(min_range, max_range + resolution, resolution)
 
-sns.set(style='darkgrid', palette="Paired")
+    coarse = np.arange(min_range, max_range + adaptive, adaptive)
+    window = resolution * np.arange(-np.ceil(adaptive / resolution), np.ceil(adaptive / resolution) + 1)
+    breakpoints = np.concatenate([params[:, 0] - params[:, 2], params[:, 0], params[:, 1],
+                                  params[:, 1] + params[:, 3]])
+    fine = (breakpoints[:, None] + window[None, :]).ravel()
+    fine = fine[(fine >= min_range) & (fine <= coarse[-1])]
+    return np.unique(np.round(np.concatenate([coarse, fine]), 10))
 
 
-def create_membership_functions(file, from_file=True):
+# storage types of packed membership tables; the integer types hold fixed-point degrees
+TABLE_DTYPES = {'float64': np.float64, 'float32': np.float32, 'uint16': np.uint16, 'uint8': np.uint8}
+
+
+class MembershipTable(dict):
+    '''
+    The sampled terms of one variable packed as the rows of a single contiguous array.
+    It behaves as the usual term name -> membership array dictionary, whose arrays are views of the rows.
+    Fixed-point tables hold integer codes instead of degrees, where degree = code * scale.
+
+        Attributes:
+            values(np.array): read-only (n_terms, grid) table, in term order
+            scale(float): the degree of one integer step (1.0 for floating-point tables)
+
+    '''
+
+
+    def __init__(self, term_names, values, scale=1.0):
+        super().__init__(zip(term_names, values))
+        self.values = values
+        self.scale = scale
+
+
+def pack_membership_table(term_memberships, dtype='float32'):
+    '''
+    Packs the sampled terms of one variable into a MembershipTable of the given storage type.
+    Integer types store the degrees rounded to the nearest of 2 ** bits - 1 steps.
+
+        Args:
+            term_memberships(dict): the membership array of each term, sampled over the same range
+            dtype(str): 'float64', 'float32', 'uint16' or 'uint8' (def: 'float32')
+
+        Returns:
+            table(MembershipTable): the packed table
+
+    '''
+
+
+    if dtype not in TABLE_DTYPES:
+        raise ValueError('Unknown table type {}'.format(dtype))
+    dtype = TABLE_DTYPES[dtype]
+    values = np.vstack([np.asarray(v, dtype=np.float64) for v in term_memberships.values()])
+    scale = 1.0
+    if np.issubdtype(dtype, np.integer):
+        scale = 1.0 / np.iinfo(dtype).max
+        values = np.round(values / scale)
+    values = np.ascontiguousarray(values, dtype=dtype)
+    values.flags.writeable = False
+    return MembershipTable(list(term_memberships.keys()), values, scale)
+
+
+def create_membership_functions(file, from_file=True, var_subset=None, resolution=0.1, adaptive=None, dtype=None):
     '''
     Creates trapezoidal membership functions using the parsed fuzzy variables.
     Generates discrete values of membership based on the estimated range of the variables.
+    The range starts at the lowest term support and its sampling can be set globally or per variable.
+    The generated arrays are read-only, so one result can be shared by any number of inferences.
 
         Args:
-            file(str): the input filename
+            file(str or KnowledgeBase): the input filename or compiled knowledge base
             from_file: feed the file as input or feed an already parsed dictionary (def. True)
+            var_subset(list): names of the variables to generate memberships for, e.g. only the consequents (def. None - all)
+            resolution(float or dict): the sampling step, or a dictionary of steps per variable name (def. 0.1)
+            adaptive(float or dict): coarse step (global or per variable) for adaptive sampling around the breakpoints (def. None)
+            dtype(str): pack the terms of every variable into a MembershipTable of this type, 'float64', 'float32',
+                'uint16' or 'uint8'; fixed-point tables are read by the custom engines only (def. None - one float64 array per term)
 
         Returns:
             fuzzy_dict(dict): the processed fuzzy variable dictionary with assigned memberships
@@ -24,7 +110,9 @@ def create_membership_functions(file, from_file=True):
     '''
 
 
-    if from_file:
+    if isinstance(file, KnowledgeBase):
+        fuzzy_variables = file.variables
+    elif from_file:
         fuzzy_variables = read_variables(file)
     else:
         fuzzy_variables = file
@@ -32,15 +120,13 @@ def create_membership_functions(file, from_file=True):
     x_ranges = {}
     var_names = []
     for k, v in fuzzy_variables.items():
+        if var_subset is not None and k not in var_subset:
+            continue
         var_name = k
-        max_range = 0
         fuzzy_val_dict = {}
-        for k_j, v_j in v.items():
-            max_range_j = v_j[1] + v_j[3]
-            if max_range_j > max_range:
-                max_range = max_range_j
-
-        x_range = np.arange(0, max_range + 0.1, 0.1)
+        var_resolution = resolution.get(var_name, 0.1) if isinstance(resolution, dict) else resolution
+        var_adaptive = adaptive.get(var_name) if isinstance(adaptive, dict) else adaptive
+        x_range = create_universe(list(v.values()), var_resolution, var_adaptive)
 
         for k_j, v_j in v.items():
             cat_name = k_j
@@ -93,8 +179,12 @@ def create_membership_functions(file, from_file=True):
             idx = np.nonzero(x_range > d)[0]
             y[idx] = np.zeros(len(idx))
 
+            y.flags.writeable = False
             fuzzy_val_dict[str(cat_name)] = y
 
+        if dtype is not None:
+            fuzzy_val_dict = pack_membership_table(fuzzy_val_dict, dtype)
+        x_range.flags.writeable = False
         x_ranges[str(var_name)] = x_range
         fuzzy_dict[str(var_name)] = fuzzy_val_dict
         var_names.append(var_name)
@@ -102,6 +192,34 @@ def create_membership_functions(file, from_file=True):
     return fuzzy_dict, x_ranges, var_names, fuzzy_variables
 
 
+def trapezoid_membership(x, fuzzy_sets):
+    '''
+    Evaluates trapezoidal membership degrees in closed form, directly from the 4-tuple parameters.
+    The result is exact and needs no discretized range of values.
+
+        Args:
+            x(float or np.array): the input value(s)
+            fuzzy_sets(list or np.array): a single (a, b, alpha, beta) 4-tuple or a (T, 4) matrix of them
+
+        Returns:
+            degrees(np.array): membership degrees of shape x.shape for a single 4-tuple, x.shape + (T,) otherwise
+
+    '''
+
+
+    params = np.asarray(fuzzy_sets, dtype=np.float64)
+    x = np.asarray(x, dtype=np.float64)
+    if params.ndim > 1:
+        x = x[..., None]
+    a, b, alpha, beta = params[..., 0], params[..., 1], params[..., 2], params[..., 3]
+
+    # vertical sides (alpha or beta equal to 0) are handled as steps instead of slopes
+    with np.errstate(divide='ignore', invalid='ignore'):
+        left = np.where(alpha > 0, (x - a + alpha) / alpha, np.where(x >= a, 1.0, 0.0))
+        right = np.where(beta > 0, (b + beta - x) / beta, np.where(x <= b, 1.0, 0.0))
+    return np.clip(np.minimum(left, right), 0.0, 1.0)
+
+
 def plot_fuzzy_sets(fuzzy_dict, x_ranges):
     '''
     Creates one plot for each fuzzy variable and displays the resulting sets.
@@ -113,6 +231,7 @@ def plot_fuzzy_sets(fuzzy_dict, x_ranges):
     '''
 
 
+    sns, plt = import_plotting()
     for k, v in fuzzy_dict.items():
         var_name = k
         plt.figure(figsize=(8, 6))
@@ -0,0 +1,339 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from modules.fuzzy_cache import load_compiled_knowledge_base
+from modules.fuzzy_defuzzifier import defuzzify_bisector_batch, defuzzify_centroid_batch
+from modules.fuzzy_exact_defuzzifier import defuzzify_exact
+from modules.fuzzy_inference import aggregate_consequent, consequent_heights, fire_rules_batch
+from modules.fuzzy_load import KnowledgeBase
+from modules.fuzzy_membership import create_membership_functions, trapezoid_membership
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    '''
+    Bounded mapping that evicts the least recently used entry, with hit/miss statistics.
+    '''
+
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        '''
+        Looks up a key and marks it as recently used.
+
+            Args:
+                key(object): the key
+
+            Returns:
+                value(object): the cached value, None if it is missing
+
+        '''
+
+
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._data[key]
+
+    def put(self, key, value):
+        '''
+        Stores a value, evicting the least recently used entries beyond max_size.
+
+            Args:
+                key(object): the key
+                value(object): the value
+
+        '''
+
+
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        '''
+        Drops every entry (the statistics are kept).
+        '''
+
+
+        self._data.clear()
+
+    def stats(self):
+        '''
+        Returns the cache statistics.
+
+            Returns:
+                stats(dict): size, max_size, hits, misses, evictions and hit_rate
+
+        '''
+
+
+        lookups = self.hits + self.misses
+        return {'size': len(self._data), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+class MemoizedInference:
+    '''
+    Inference with two LRU caches keyed on quantized inputs: the term degrees of every (variable, value) pair
+    and the crisp outputs of every full input vector. Inputs are rounded to the nearest multiple of the
+    quantization step before the lookup, so the outputs are those of the quantized inputs.
+    A knowledge base given by filename is reloaded, and both caches cleared, once the file changes.
+
+        Attributes:
+            kb(KnowledgeBase): the compiled knowledge base
+            consequents(list): the consequents being evaluated
+            degree_cache(LRUCache): term degrees per (variable, quantized value)
+            output_cache(LRUCache): outputs per quantized input vector
+
+    '''
+
+
+    def __init__(self, file, quantum=None, max_degrees=100000, max_outputs=100000, consequents=None,
+                 method='centroid', engine='exact', check_interval=1.0):
+        '''
+        Loads the knowledge base and creates the empty caches.
+
+            Args:
+                file(str or KnowledgeBase): the input knowledge base file name or compiled knowledge base
+                quantum(float or dict): the quantization step, global or per antecedent (def: None - exact values)
+                max_degrees(int): maximum number of cached (variable, value) degree vectors (def: 100000)
+                max_outputs(int): maximum number of cached input vectors (def: 100000)
+                consequents(list): the consequents to evaluate (def: kb.consequents)
+                method(str): 'centroid' or 'bisector' (def: 'centroid')
+                engine(str): 'exact' or 'sampled' (def: 'exact')
+                check_interval(float): minimum seconds between two checks of the source file (def: 1.0)
+
+        '''
+
+
+        if method not in ('centroid', 'bisector'):
+            raise ValueError('Unknown defuzzification method {}'.format(method))
+        if engine not in ('exact', 'sampled'):
+            raise ValueError('Unknown engine {}'.format(engine))
+        self.quantum = quantum
+        self.method = method
+        self.engine = engine
+        self.check_interval = check_interval
+        self.degree_cache = LRUCache(max_degrees)
+        self.output_cache = LRUCache(max_outputs)
+        self._consequents = consequents
+        self._file = None if isinstance(file, KnowledgeBase) else file
+        self._signature = None
+        self._checked = 0.0
+        if self._file is None:
+            self._set_knowledge_base(file, None)
+        else:
+            self.refresh(force=True)
+
+    def _set_knowledge_base(self, kb, tables):
+        self.kb = kb
+        self._tables = tables
+        self.consequents = list(kb.consequents if self._consequents is None else self._consequents)
+        steps = self.quantum if isinstance(self.quantum, dict) else {}
+        self._steps = [steps.get(var_name, None if isinstance(self.quantum, dict) else self.quantum)
+                       for var_name in kb.antecedents]
+        self.degree_cache.clear()
+        self.output_cache.clear()
+
+    def set_knowledge_base(self, kb):
+        '''
+        Replaces the knowledge base and clears both caches.
+
+            Args:
+                kb(KnowledgeBase): the new compiled knowledge base
+
+        '''
+
+
+        self._file = None
+        self._set_knowledge_base(kb, None)
+
+    def refresh(self, force=False):
+        '''
+        Reloads the knowledge base, and clears both caches, if its source file changed since it was loaded.
+        The file is checked at most once per check_interval unless forced. If the file is missing or cannot be
+        parsed, the loaded knowledge base and both caches are kept and the file is checked again later.
+
+            Args:
+                force(bool): check the file now (def: False)
+
+            Returns:
+                reloaded(bool): True if the knowledge base was reloaded
+
+        '''
+
+
+        if self._file is None:
+            return False
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return False
+        self._checked = now
+        try:
+            stat = os.stat(self._file)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature == self._signature:
+                return False
+            kb, tables = load_compiled_knowledge_base(self._file)
+        except (OSError, ValueError):
+            if self._signature is None:
+                raise
+            # the file is missing or being rewritten, keep serving the last good knowledge base
+            logger.warning('Could not reload %s, keeping the loaded knowledge base', self._file, exc_info=True)
+            return False
+        self._signature = signature
+        self._set_knowledge_base(kb, tables)
+        return True
+
+    def quantize(self, measurements):
+        '''
+        Rounds measurement rows to the quantization steps of their antecedents.
+
+            Args:
+                measurements(np.array): (N, n_antecedents) matrix in kb.antecedents order
+
+            Returns:
+                quantized(np.array): (N, n_antecedents) matrix of quantized values
+
+        '''
+
+
+        quantized = np.array(measurements, dtype=np.float64, ndmin=2)
+        for col, step in enumerate(self._steps):
+            if step:
+                quantized[:, col] = np.round(quantized[:, col] / step) * step
+        return quantized
+
+    def degrees(self, var_name, value):
+        '''
+        Returns the term degrees of an antecedent value through the degree cache.
+        The value is expected to be quantized already.
+
+            Args:
+                var_name(str): the antecedent name
+                value(float): the (quantized) value
+
+            Returns:
+                degrees(np.array): (n_terms,) membership degree of every term (read-only)
+
+        '''
+
+
+        key = (var_name, value)
+        degrees = self.degree_cache.get(key)
+        if degrees is None:
+            degrees = trapezoid_membership(value, self.kb.term_params[var_name])
+            degrees.flags.writeable = False
+            self.degree_cache.put(key, degrees)
+        return degrees
+
+    def _infer(self, quantized):
+        degrees = [None] * len(self.kb.var_names)
+        for col, var_name in enumerate(self.kb.antecedents):
+            degrees[self.kb.var_names.index(var_name)] = np.vstack([self.degrees(var_name, value)
+                                                                   for value in quantized[:, col].tolist()])
+        strengths = fire_rules_batch(self.kb, degrees)
+
+        outputs = {}
+        for consequent in self.consequents:
+            heights = consequent_heights(self.kb, strengths, consequent)
+            if self.engine == 'exact':
+                outputs[consequent] = defuzzify_exact(self.kb.term_params[consequent], heights, self.method)
+                continue
+            fuzzy_dict, x_ranges = self._tables[0], self._tables[1]
+            aggregated_mfx = aggregate_consequent(self.kb, heights, consequent, fuzzy_dict, x_ranges[consequent])
+            if self.method == 'bisector':
+                outputs[consequent] = defuzzify_bisector_batch(x_ranges[consequent], aggregated_mfx)
+            else:
+                outputs[consequent] = defuzzify_centroid_batch(x_ranges[consequent], aggregated_mfx)
+        return outputs
+
+    def evaluate_many(self, measurements):
+        '''
+        Evaluates a batch of measurement rows; only the input vectors missing from the output cache are inferred.
+        Rows with a missing (NaN) antecedent give NaN and are not cached.
+
+            Args:
+                measurements(np.array): (N, n_antecedents) matrix in kb.antecedents order
+
+            Returns:
+                outputs(dict): (N,) defuzzified values for each consequent
+
+        '''
+
+
+        self.refresh()
+        if self.engine == 'sampled' and self._tables is None:
+            self._tables = create_membership_functions(self.kb, var_subset=self.consequents)
+        quantized = self.quantize(measurements)
+        outputs = {c: np.full(quantized.shape[0], np.nan) for c in self.consequents}
+
+        # repeated input vectors are looked up, and inferred, once
+        key_rows = OrderedDict()
+        for row_idx, row in enumerate(quantized.tolist()):
+            if not any(v != v for v in row):
+                key_rows.setdefault(tuple(row), []).append(row_idx)
+
+        missing = {}
+        for key, row_ids in key_rows.items():
+            cached = self.output_cache.get(key)
+            if cached is None:
+                missing[key] = row_ids
+            else:
+                for consequent, value in zip(self.consequents, cached):
+                    outputs[consequent][row_ids] = value
+
+        if missing:
+            keys = list(missing)
+            results = self._infer(np.array(keys, dtype=np.float64).reshape(len(keys), -1))
+            for key_idx, key in enumerate(keys):
+                values = tuple(float(results[c][key_idx]) for c in self.consequents)
+                self.output_cache.put(key, values)
+                for consequent, value in zip(self.consequents, values):
+                    outputs[consequent][missing[key]] = value
+        return outputs
+
+    def evaluate(self, inputs):
+        '''
+        Evaluates a single measurement dictionary through the caches.
+
+            Args:
+                inputs(dict): the value of each antecedent
+
+            Returns:
+                outputs(dict): the defuzzified value of each consequent (NaN where undefined)
+
+        '''
+
+
+        row = [inputs.get(var_name, np.nan) for var_name in self.kb.antecedents]
+        return {k: float(v[0]) for k, v in self.evaluate_many(np.array([row], dtype=np.float64)).items()}
+
+    def stats(self):
+        '''
+        Returns the statistics of both caches.
+
+            Returns:
+                stats(dict): 'degrees' and 'outputs' statistics, see LRUCache.stats
+
+        '''
+
+
+        return {'degrees': self.degree_cache.stats(), 'outputs': self.output_cache.stats()}
@@ -0,0 +1,177 @@
+import functools
+import time
+from collections import defaultdict
+
+# per-process instrumentation state; everything below is a no-op until enable_metrics() is called
+_metrics_state = {'enabled': False, 'timers': defaultdict(lambda: [0, 0.0]), 'counters': defaultdict(int),
+                  'hooks': []}
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.perf_counter() - self._start
+        timer = _metrics_state['timers'][self.name]
+        timer[0] += 1
+        timer[1] += elapsed
+        for hook in _metrics_state['hooks']:
+            hook('timer', self.name, elapsed)
+        return False
+
+
+def enable_metrics(enabled=True):
+    '''
+    Switches the collection of stage timings and counters on or off for the current process.
+
+        Args:
+            enabled(bool): True to collect metrics (def: True)
+
+    '''
+
+
+    _metrics_state['enabled'] = bool(enabled)
+
+
+def metrics_enabled():
+    '''
+    Tells whether metrics are being collected in the current process.
+
+        Returns:
+            enabled(bool): True if metrics are enabled
+
+    '''
+
+
+    return _metrics_state['enabled']
+
+
+def stage(name):
+    '''
+    Times a block of code as one call of a named stage, e.g. with stage('fuzzify'): ...
+    When metrics are disabled a shared no-op context is returned, so the overhead is one function call.
+
+        Args:
+            name(str): the stage name ('parse', 'fuzzify', 'fire_rules', 'aggregate' or 'defuzzify')
+
+        Returns:
+            context(object): the context manager timing the block
+
+    '''
+
+
+    if not _metrics_state['enabled']:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def timed(name):
+    '''
+    Decorator timing every call of a function as one call of a named stage, see stage.
+
+        Args:
+            name(str): the stage name
+
+        Returns:
+            decorator(callable): the decorator
+
+    '''
+
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _metrics_state['enabled']:
+                return func(*args, **kwargs)
+            with _Stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    '''
+    Adds a value to a named counter, if metrics are enabled.
+
+        Args:
+            name(str): the counter name
+            value(int): the increment (def: 1)
+
+    '''
+
+
+    if not _metrics_state['enabled']:
+        return
+    _metrics_state['counters'][name] += value
+    for hook in _metrics_state['hooks']:
+        hook('counter', name, value)
+
+
+def add_metrics_hook(hook):
+    '''
+    Registers a callback that receives every measurement as it is recorded, for exporting to a monitoring system.
+    The hook is called as hook(kind, name, value), where kind is 'timer' (value in seconds) or 'counter'.
+
+        Args:
+            hook(callable): the callback
+
+    '''
+
+
+    _metrics_state['hooks'].append(hook)
+
+
+def remove_metrics_hook(hook):
+    '''
+    Unregisters a callback added with add_metrics_hook.
+
+        Args:
+            hook(callable): the callback
+
+    '''
+
+
+    _metrics_state['hooks'].remove(hook)
+
+
+def get_metrics():
+    '''
+    Returns a snapshot of the collected metrics.
+
+        Returns:
+            metrics(dict): 'timers' maps every stage to its call count and total and mean seconds,
+                'counters' maps every counter to its value
+
+    '''
+
+
+    timers = {}
+    for name, (calls, total) in _metrics_state['timers'].items():
+        timers[name] = {'calls': calls, 'total': total, 'mean': total / calls if calls else 0.0}
+    return {'timers': timers, 'counters': dict(_metrics_state['counters'])}
+
+
+def reset_metrics():
+    '''
+    Clears the collected timings and counters (the enabled flag and hooks are kept).
+    '''
+
+
+    _metrics_state['timers'].clear()
+    _metrics_state['counters'].clear()
@@ -0,0 +1,23 @@
+_plot_style = {'style': 'darkgrid', 'palette': 'Paired'}
+_style_applied = []
+
+
+def import_plotting():
+    '''
+    Imports seaborn and matplotlib on first use and applies the plot style of the project.
+    The inference modules only call it from their plotting functions, so importing them stays headless.
+
+        Returns:
+            sns(module): the seaborn module
+            plt(module): the matplotlib.pyplot module
+
+    '''
+
+
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    if not _style_applied:
+        sns.set(**_plot_style)
+        _style_applied.append(True)
+    return sns, plt
@@ -0,0 +1,321 @@
+import asyncio
+import json
+import logging
+import os
+
+import numpy as np
+
+from modules.fuzzy_cache import load_compiled_knowledge_base
+from modules.fuzzy_metrics import count
+from modules.fuzzy_stream import _parse_value, evaluate_consequents
+
+logger = logging.getLogger(__name__)
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class InferenceModel:
+    '''
+    A knowledge base loaded once for serving, evaluated on whole batches of measurement rows.
+
+        Attributes:
+            name(str): the name the model is served under
+            kb(KnowledgeBase): the compiled knowledge base
+            engine(str): 'exact' (grid-free) or 'sampled' (membership tables)
+            method(str): 'centroid' or 'bisector'
+
+    '''
+
+
+    def __init__(self, file, name=None, engine='exact', method='centroid'):
+        '''
+        Loads the knowledge base through its compiled cache.
+
+            Args:
+                file(str): the knowledge base filename
+                name(str): the name the model is served under (def: None - the filename without extension)
+                engine(str): 'exact' or 'sampled' (def: 'exact')
+                method(str): 'centroid' or 'bisector' (def: 'centroid')
+
+        '''
+
+
+        if engine not in ('exact', 'sampled'):
+            raise ValueError('Unknown engine {}'.format(engine))
+        self.name = name or os.path.splitext(os.path.basename(file))[0]
+        self.kb, self._tables = load_compiled_knowledge_base(file)
+        self.engine = engine
+        self.method = method
+
+    def describe(self):
+        '''
+        Summarizes the model for clients.
+
+            Returns:
+                description(dict): the antecedents with their (low, high) term support and the consequents
+
+        '''
+
+
+        ranges = {}
+        for var_name in self.kb.antecedents:
+            params = self.kb.term_params[var_name]
+            ranges[var_name] = [float(np.min(params[:, 0] - params[:, 2])), float(np.max(params[:, 1] + params[:, 3]))]
+        return {'antecedents': ranges, 'consequents': self.kb.consequents, 'engine': self.engine,
+                'method': self.method}
+
+    def evaluate(self, measurements):
+        '''
+        Evaluates a batch of measurement rows.
+
+            Args:
+                measurements(np.array): (N, n_antecedents) matrix in kb.antecedents order
+
+            Returns:
+                outputs(dict): (N,) defuzzified values for each consequent, NaN where undefined
+
+        '''
+
+
+        fuzzy_dict, x_ranges = (self._tables[0], self._tables[1]) if self.engine == 'sampled' else (None, None)
+        return evaluate_consequents(self.kb, measurements, self.kb.antecedents, self.kb.consequents, self.method,
+                                    fuzzy_dict, x_ranges)
+
+
+class MicroBatcher:
+    '''
+    Gathers the rows submitted by concurrent requests into micro-batches. A batch is evaluated once it holds
+    max_batch_size rows or max_wait seconds after its first row arrived, whichever comes first.
+    The inference runs in the default executor, so new requests keep being accepted meanwhile.
+    '''
+
+
+    def __init__(self, model, max_batch_size=256, max_wait=0.002):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = asyncio.Queue()
+
+    async def submit(self, row):
+        '''
+        Queues one measurement row and waits for its outputs.
+
+            Args:
+                row(list): the measurement values in kb.antecedents order
+
+            Returns:
+                outputs(dict): the defuzzified value of each consequent (NaN where undefined)
+
+        '''
+
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future))
+        return await future
+
+    async def run(self):
+        '''
+        Collects and evaluates micro-batches until cancelled.
+        '''
+
+
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            count('server_batches')
+            count('server_rows', len(batch))
+            measurements = np.array([row for row, _ in batch], dtype=np.float64).reshape(len(batch), -1)
+            try:
+                outputs = await loop.run_in_executor(None, self.model.evaluate, measurements)
+            except Exception as e:
+                logger.exception('Inference failed for a batch of %d rows', len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for row_idx, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result({k: float(v[row_idx]) for k, v in outputs.items()})
+
+
+class InferenceServer:
+    '''
+    HTTP/1.1 inference server over TCP or a Unix socket, with one micro-batcher per served model.
+    Connections are kept alive between requests. Routes:
+        GET /health - liveness check
+        GET /models - the served models with their antecedents and consequents
+        POST /infer/<model> - body {"inputs": {antecedent: value, ...}} or {"inputs": [{...}, ...]},
+            answered with {"outputs": {consequent: value, ...}} (or a list), null where undefined
+    '''
+
+
+    def __init__(self, models, max_batch_size=256, max_wait=0.002):
+        '''
+        Args:
+            models(list): the InferenceModel objects to serve
+            max_batch_size(int): maximum number of rows per micro-batch (def: 256)
+            max_wait(float): maximum seconds a row waits for its micro-batch to fill up (def: 0.002)
+
+        '''
+
+
+        self.models = {model.name: model for model in models}
+        self.batchers = {name: MicroBatcher(model, max_batch_size, max_wait) for name, model in self.models.items()}
+        self._tasks = []
+
+    async def start(self, host='127.0.0.1', port=8080, path=None):
+        '''
+        Starts the batchers and the listening socket.
+
+            Args:
+                host(str): the TCP host (def: '127.0.0.1')
+                port(int): the TCP port (def: 8080)
+                path(str): a Unix socket path, used instead of TCP if given (def: None)
+
+            Returns:
+                server(asyncio.AbstractServer): the listening server
+
+        '''
+
+
+        self._tasks = [asyncio.ensure_future(batcher.run()) for batcher in self.batchers.values()]
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle_connection, path)
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def stop(self):
+        '''
+        Cancels the batchers.
+        '''
+
+
+        for task in self._tasks:
+            task.cancel()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                parts = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if len(parts) != 3:
+                    status, payload = 400, {'error': 'Malformed request line'}
+                else:
+                    status, payload = await self.dispatch(parts[0], parts[1], body)
+                keep_alive = len(parts) == 3 and parts[2] == 'HTTP/1.1' and headers.get('connection') != 'close'
+
+                data = json.dumps(payload).encode()
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                             'Connection: {}\r\n\r\n'.format(status, _REASONS[status], len(data),
+                                                             'keep-alive' if keep_alive else 'close').encode())
+                writer.write(data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body):
+        '''
+        Routes one request.
+
+            Args:
+                method(str): the HTTP method
+                path(str): the request path
+                body(bytes): the request body
+
+            Returns:
+                status(int): the HTTP status code
+                payload(object): the JSON response
+
+        '''
+
+
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        elif path == '/models':
+            return 200, {name: model.describe() for name, model in self.models.items()}
+        elif not path.startswith('/infer/'):
+            return 404, {'error': 'Unknown path {}'.format(path)}
+        elif method != 'POST':
+            return 405, {'error': 'Use POST for inference'}
+
+        name = path[len('/infer/'):]
+        if name not in self.models:
+            return 404, {'error': 'Unknown model {}'.format(name)}
+        try:
+            inputs = json.loads(body.decode())['inputs']
+            rows = inputs if isinstance(inputs, list) else [inputs]
+            rows = [[_parse_value(row.get(var_name)) for var_name in self.models[name].kb.antecedents] for row in rows]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return 400, {'error': 'Expected a JSON body {"inputs": {antecedent: value, ...}}'}
+
+        try:
+            results = await asyncio.gather(*[self.batchers[name].submit(row) for row in rows])
+        except Exception as e:
+            return 500, {'error': str(e)}
+        results = [{k: None if np.isnan(v) else v for k, v in outputs.items()} for outputs in results]
+        return 200, {'outputs': results if isinstance(inputs, list) else results[0]}
+
+
+async def _serve(models, host, port, path, max_batch_size, max_wait):
+    # the server is built inside the running loop, so its queues belong to it
+    server = InferenceServer(models, max_batch_size, max_wait)
+    listener = await server.start(host, port, path)
+    logger.info('Serving %s on %s', ', '.join(server.models), path or '{}:{}'.format(host, port))
+    try:
+        await listener.serve_forever()
+    finally:
+        server.stop()
+        listener.close()
+        await listener.wait_closed()
+
+
+def serve(files, host='127.0.0.1', port=8080, path=None, max_batch_size=256, max_wait=0.002, engine='exact',
+          method='centroid'):
+    '''
+    Loads the knowledge bases and serves them until interrupted.
+
+        Args:
+            files(list): the knowledge base filenames
+            host(str): the TCP host (def: '127.0.0.1')
+            port(int): the TCP port (def: 8080)
+            path(str): a Unix socket path, used instead of TCP if given (def: None)
+            max_batch_size(int): maximum number of rows per micro-batch (def: 256)
+            max_wait(float): maximum seconds a row waits for its micro-batch to fill up (def: 0.002)
+            engine(str): 'exact' or 'sampled' (def: 'exact')
+            method(str): 'centroid' or 'bisector' (def: 'centroid')
+
+    '''
+
+
+    models = [InferenceModel(file, engine=engine, method=method) for file in files]
+    try:
+        asyncio.run(_serve(models, host, port, path, max_batch_size, max_wait))
+    except KeyboardInterrupt:
+        pass
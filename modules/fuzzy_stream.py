@@ -0,0 +1,159 @@
+import csv
+import itertools
+import json
+
+import numpy as np
+
+from modules.fuzzy_defuzzifier import defuzzify_bisector_batch
+from modules.fuzzy_exact_defuzzifier import infer_exact_consequents
+from modules.fuzzy_inference import infer_batch_consequents
+
+
+def _parse_value(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def open_measurement_stream(fp, fmt='csv'):
+    '''
+    Opens a CSV (with a header row) or JSON-lines stream of measurement rows.
+
+        Args:
+            fp(file): the input stream
+            fmt(str): 'csv' or 'jsonl' (def: 'csv')
+
+        Returns:
+            fieldnames(list): the CSV header (None for JSON lines)
+            records(iterator): the measurement rows as dictionaries, parsed lazily
+
+    '''
+
+
+    if fmt == 'csv':
+        reader = csv.DictReader(fp)
+        return reader.fieldnames or [], reader
+    elif fmt == 'jsonl':
+        return None, (json.loads(line) for line in fp if line.strip())
+    raise ValueError('Unknown stream format {}'.format(fmt))
+
+
+def read_measurement_chunks(records, antecedents, chunk_size=10000):
+    '''
+    Groups a stream of measurement rows into fixed-size chunks, so only one chunk is held in memory at a time.
+    Missing or non-numeric values are read as NaN.
+
+        Args:
+            records(iterator): the measurement rows as dictionaries
+            antecedents(list): the antecedent names, looked up in every row
+            chunk_size(int): number of rows per chunk (def: 10000)
+
+        Returns:
+            chunks(generator): (records, measurements) pairs, where measurements is the (rows, n_antecedents) matrix
+                of the records in the chunk
+
+    '''
+
+
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return
+        values = [[_parse_value(record.get(var_name)) for var_name in antecedents] for record in chunk]
+        yield chunk, np.array(values, dtype=np.float64).reshape(len(chunk), len(antecedents))
+
+
+def evaluate_consequents(kb, measurements, antecedents=None, consequents=None, method='centroid', fuzzy_dict=None,
+                         x_ranges=None):
+    '''
+    Evaluates the inference engine for a batch of measurement vectors and several consequents.
+    Uses the exact grid-free engine, or the sampled one if membership tables are given.
+    Rows with a missing antecedent value give NaN.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            measurements(np.array): (N, n_antecedents) matrix with one measurement vector per row
+            antecedents(list): the variable name of each measurement column (def: kb.antecedents)
+            consequents(list): the target consequent variables (def: kb.consequents)
+            method(str): 'centroid' or 'bisector' (def: 'centroid')
+            fuzzy_dict(dict): membership tables from create_membership_functions (def: None - exact engine)
+            x_ranges(dict): membership ranges from create_membership_functions (def: None - exact engine)
+
+        Returns:
+            outputs(dict): (N,) defuzzified values for each consequent
+
+    '''
+
+
+    if fuzzy_dict is None:
+        outputs = infer_exact_consequents(kb, measurements, antecedents, consequents, method)
+    else:
+        outputs = {}
+        batch_outputs = infer_batch_consequents(kb, measurements, fuzzy_dict, x_ranges, antecedents, consequents)
+        for consequent, (results, conseq_range, aggregated_mfx) in batch_outputs.items():
+            if method == 'bisector':
+                results = defuzzify_bisector_batch(conseq_range, aggregated_mfx)
+            outputs[consequent] = results
+
+    incomplete = ~np.all(np.isfinite(measurements), axis=1)
+    for results in outputs.values():
+        results[incomplete] = np.nan
+    return outputs
+
+
+def stream_inference(kb, input_fp, output_fp, fmt='csv', chunk_size=10000, antecedents=None, consequents=None,
+                     method='centroid', fuzzy_dict=None, x_ranges=None):
+    '''
+    Runs batched inference over a stream of measurement rows and writes the results incrementally.
+    Every output row is the input row with one column (CSV) or key (JSON lines) added per consequent;
+    undefined results are written as an empty field (CSV) or null (JSON lines).
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            input_fp(file): the input stream of measurement rows
+            output_fp(file): the output stream
+            fmt(str): 'csv' or 'jsonl' (def: 'csv')
+            chunk_size(int): number of rows inferenced at once (def: 10000)
+            antecedents(list): the antecedent names to read (def: kb.antecedents)
+            consequents(list): the consequents to infer (def: kb.consequents)
+            method(str): 'centroid' or 'bisector' (def: 'centroid')
+            fuzzy_dict(dict): membership tables from create_membership_functions (def: None - exact engine)
+            x_ranges(dict): membership ranges from create_membership_functions (def: None - exact engine)
+
+        Returns:
+            n_rows(int): number of processed rows
+
+    '''
+
+
+    if antecedents is None:
+        antecedents = kb.antecedents
+    if consequents is None:
+        consequents = kb.consequents
+
+    fieldnames, records = open_measurement_stream(input_fp, fmt)
+    if fmt == 'csv':
+        missing = [var_name for var_name in antecedents if var_name not in fieldnames]
+        if missing:
+            raise ValueError('Missing measurement columns {}'.format(', '.join(missing)))
+        writer = csv.DictWriter(output_fp, fieldnames + [c for c in consequents if c not in fieldnames],
+                                extrasaction='ignore', lineterminator='\n')
+        writer.writeheader()
+
+    n_rows = 0
+    for chunk, measurements in read_measurement_chunks(records, antecedents, chunk_size):
+        outputs = evaluate_consequents(kb, measurements, antecedents, consequents, method, fuzzy_dict, x_ranges)
+        for consequent in consequents:
+            for record, value in zip(chunk, outputs[consequent].tolist()):
+                record[consequent] = None if np.isnan(value) else value
+
+        if fmt == 'csv':
+            writer.writerows(chunk)
+        else:
+            output_fp.writelines(json.dumps(record) + '\n' for record in chunk)
+        output_fp.flush()
+        n_rows += len(chunk)
+
+    return n_rows
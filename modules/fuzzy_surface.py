@@ -0,0 +1,260 @@
+import bisect
+import itertools
+from multiprocessing import Pool
+
+import numpy as np
+
+from modules.fuzzy_defuzzifier import defuzzify_bisector_batch
+from modules.fuzzy_exact_defuzzifier import infer_exact
+from modules.fuzzy_inference import infer_batch
+
+
+class ControlSurface:
+    '''
+    Precompiled mapping from the antecedent values to the crisp consequent value.
+    Queries are answered by multilinear interpolation between the stored grid points.
+
+        Attributes:
+            axes(list): the sorted grid of values of each antecedent
+            values(np.array): the crisp values at every grid point, one dimension per antecedent
+            antecedents(list): the antecedent name of each axis
+            consequent(str): the consequent variable name
+            method(str): the defuzzification method the surface was compiled with
+
+    '''
+
+
+    def __init__(self, axes, values, antecedents, consequent, method='centroid'):
+        self.axes = [np.asarray(axis, dtype=np.float64) for axis in axes]
+        self.values = np.asarray(values, dtype=np.float64)
+        self.antecedents = list(antecedents)
+        self.consequent = consequent
+        self.method = method
+        if any(len(axis) < 2 for axis in self.axes):
+            raise ValueError('Every axis of the control surface needs at least 2 points')
+        self._axis_lists = [axis.tolist() for axis in self.axes]
+        self._corners = list(itertools.product((0, 1), repeat=len(self.axes)))
+
+    def evaluate(self, measurements):
+        '''
+        Interpolates the crisp values for a batch of measurement vectors.
+        Measurements outside the compiled grid are clamped to its bounds.
+
+            Args:
+                measurements(np.array): (N, n_antecedents) matrix with one measurement vector per row
+
+            Returns:
+                results(np.array): (N,) interpolated crisp values (NaN next to grid points where no rule fires)
+
+        '''
+
+
+        measurements = np.atleast_2d(np.asarray(measurements, dtype=np.float64))
+        lower = []
+        fraction = []
+        for col, axis in enumerate(self.axes):
+            x = np.clip(measurements[:, col], axis[0], axis[-1])
+            idx = np.clip(np.searchsorted(axis, x, side='right') - 1, 0, len(axis) - 2)
+            lower.append(idx)
+            fraction.append((x - axis[idx]) / (axis[idx + 1] - axis[idx]))
+
+        results = np.zeros(measurements.shape[0])
+        for corner in itertools.product((0, 1), repeat=len(self.axes)):
+            weight = np.ones(measurements.shape[0])
+            for col, offset in enumerate(corner):
+                weight *= fraction[col] if offset else 1.0 - fraction[col]
+            corner_values = self.values[tuple(lower[col] + offset for col, offset in enumerate(corner))]
+            results += np.where(weight > 0, weight * corner_values, 0.0)
+
+        return results
+
+    def evaluate_point(self, measurement):
+        '''
+        Interpolates the crisp value for a single measurement vector with plain Python arithmetic,
+        which avoids the array overhead of evaluate on the latency-critical path.
+
+            Args:
+                measurement(list): the value of each antecedent, in axis order
+
+            Returns:
+                result(float): the interpolated crisp value
+
+        '''
+
+
+        lower = []
+        fraction = []
+        for x, axis in zip(measurement, self._axis_lists):
+            x = min(max(float(x), axis[0]), axis[-1])
+            idx = min(max(bisect.bisect_right(axis, x) - 1, 0), len(axis) - 2)
+            lower.append(idx)
+            fraction.append((x - axis[idx]) / (axis[idx + 1] - axis[idx]))
+
+        result = 0.0
+        for corner in self._corners:
+            weight = 1.0
+            for col, offset in enumerate(corner):
+                weight *= fraction[col] if offset else 1.0 - fraction[col]
+            if weight > 0:
+                result += weight * self.values.item(*[lower[col] + offset for col, offset in enumerate(corner)])
+        return result
+
+    def save(self, file):
+        '''
+        Stores the compiled surface in a numpy .npz archive.
+
+            Args:
+                file(str): the output filename
+
+        '''
+
+
+        axes = {'axis_' + str(col): axis for col, axis in enumerate(self.axes)}
+        np.savez(file, values=self.values, antecedents=np.array(self.antecedents),
+                 consequent=np.array(self.consequent), method=np.array(self.method), **axes)
+
+
+def load_control_surface(file):
+    '''
+    Loads a control surface stored with ControlSurface.save.
+
+        Args:
+            file(str): the .npz filename
+
+        Returns:
+            surface(ControlSurface): the compiled control surface
+
+    '''
+
+
+    with np.load(file) as data:
+        antecedents = [str(name) for name in data['antecedents']]
+        axes = [data['axis_' + str(col)] for col in range(len(antecedents))]
+        return ControlSurface(axes, data['values'], antecedents, str(data['consequent']), str(data['method']))
+
+
+def evaluate_engine(kb, measurements, antecedents=None, consequent=None, method='centroid', fuzzy_dict=None,
+                    x_ranges=None):
+    '''
+    Evaluates the full inference engine for a batch of measurement vectors.
+    Uses the exact grid-free engine, or the sampled one if membership tables are given.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            measurements(np.array): (N, n_antecedents) matrix with one measurement vector per row
+            antecedents(list): the variable name of each measurement column (def: kb.antecedents)
+            consequent(str): the target consequent variable (def: the last consequent of the knowledge base)
+            method(str): 'centroid' or 'bisector' (def: 'centroid')
+            fuzzy_dict(dict): membership tables from create_membership_functions (def: None - exact engine)
+            x_ranges(dict): membership ranges from create_membership_functions (def: None - exact engine)
+
+        Returns:
+            results(np.array): (N,) defuzzified values
+
+    '''
+
+
+    if fuzzy_dict is None:
+        return infer_exact(kb, measurements, antecedents, consequent, method)
+    results, conseq_range, aggregated_mfx = infer_batch(kb, measurements, fuzzy_dict, x_ranges, antecedents,
+                                                        consequent)
+    if method == 'bisector':
+        return defuzzify_bisector_batch(conseq_range, aggregated_mfx)
+    return results
+
+
+def _evaluate_chunk(args):
+    return evaluate_engine(*args)
+
+
+def compile_control_surface(kb, grid=101, antecedents=None, consequent=None, method='centroid', fuzzy_dict=None,
+                            x_ranges=None, n_jobs=1, chunk_size=10000):
+    '''
+    Evaluates the inference engine over a grid of antecedent values and stores the resulting control surface.
+    The grid points are scored in vectorized chunks, optionally spread over a process pool.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            grid(int, dict or list): number of points per axis, a dictionary of point counts or value arrays per
+                antecedent, or a list of value arrays (def: 101 points spanning each antecedent's term supports)
+            antecedents(list): the antecedent name of each axis (def: kb.antecedents)
+            consequent(str): the target consequent variable (def: the last consequent of the knowledge base)
+            method(str): 'centroid' or 'bisector' (def: 'centroid')
+            fuzzy_dict(dict): membership tables from create_membership_functions (def: None - exact engine)
+            x_ranges(dict): membership ranges from create_membership_functions (def: None - exact engine)
+            n_jobs(int): number of worker processes (def: 1 - evaluate in this process)
+            chunk_size(int): grid points per vectorized evaluation (def: 10000)
+
+        Returns:
+            surface(ControlSurface): the compiled control surface
+
+    '''
+
+
+    if antecedents is None:
+        antecedents = kb.antecedents
+    if consequent is None:
+        consequent = kb.consequents[-1]
+
+    axes = []
+    for col, var_name in enumerate(antecedents):
+        if isinstance(grid, dict):
+            axis = grid.get(var_name, 101)
+        elif isinstance(grid, (list, tuple)):
+            axis = grid[col]
+        else:
+            axis = grid
+        if np.ndim(axis) == 0:
+            params = kb.term_params[var_name]
+            axis = np.linspace(np.min(params[:, 0] - params[:, 2]), np.max(params[:, 1] + params[:, 3]), int(axis))
+        axes.append(np.asarray(axis, dtype=np.float64))
+
+    points = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(axes))
+    chunks = [(kb, points[i:i + chunk_size], antecedents, consequent, method, fuzzy_dict, x_ranges)
+              for i in range(0, len(points), chunk_size)]
+    if n_jobs > 1:
+        with Pool(n_jobs) as pool:
+            results = pool.map(_evaluate_chunk, chunks)
+    else:
+        results = [_evaluate_chunk(chunk) for chunk in chunks]
+
+    values = np.concatenate(results).reshape([len(axis) for axis in axes])
+    return ControlSurface(axes, values, antecedents, consequent, method)
+
+
+def surface_error_report(surface, kb, n_samples=10000, seed=0, fuzzy_dict=None, x_ranges=None):
+    '''
+    Measures the interpolation error of a control surface against the full inference engine
+    at uniformly sampled points inside the compiled grid.
+
+        Args:
+            surface(ControlSurface): the compiled control surface
+            kb(KnowledgeBase): the compiled knowledge base
+            n_samples(int): number of random test points (def: 10000)
+            seed(int): seed of the random test points (def: 0)
+            fuzzy_dict(dict): membership tables of the reference engine (def: None - exact engine)
+            x_ranges(dict): membership ranges of the reference engine (def: None - exact engine)
+
+        Returns:
+            report(dict): max, mean, 99th percentile and RMS absolute error, and the share of points
+                where only one of the two results is defined (nan_mismatch)
+
+    '''
+
+
+    rng = np.random.RandomState(seed)
+    measurements = np.column_stack([rng.uniform(axis[0], axis[-1], n_samples) for axis in surface.axes])
+    expected = evaluate_engine(kb, measurements, surface.antecedents, surface.consequent, surface.method,
+                               fuzzy_dict, x_ranges)
+    actual = surface.evaluate(measurements)
+
+    defined = np.isfinite(expected) & np.isfinite(actual)
+    error = np.abs(expected[defined] - actual[defined])
+    if len(error) == 0:
+        error = np.array([np.nan])
+    return {'n_samples': n_samples,
+            'max_abs_error': float(np.max(error)),
+            'mean_abs_error': float(np.mean(error)),
+            'p99_abs_error': float(np.percentile(error, 99)),
+            'rmse': float(np.sqrt(np.mean(error ** 2))),
+            'nan_mismatch': float(np.mean(np.isfinite(expected) != np.isfinite(actual)))}
@@ -0,0 +1,20 @@
+import argparse
+import logging
+
+from modules.fuzzy_server import serve
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve knowledge bases over HTTP with micro-batched inference')
+    parser.add_argument('files', nargs='+', help='knowledge base files, served under their name without extension')
+    parser.add_argument('--host', default='127.0.0.1', help='TCP host')
+    parser.add_argument('--port', type=int, default=8080, help='TCP port')
+    parser.add_argument('--unix', help='listen on this Unix socket path instead of TCP')
+    parser.add_argument('--max-batch-size', type=int, default=256, help='maximum rows per micro-batch')
+    parser.add_argument('--max-wait-ms', type=float, default=2.0, help='maximum wait for a micro-batch to fill up')
+    parser.add_argument('--engine', choices=['exact', 'sampled'], default='exact', help='inference engine')
+    parser.add_argument('--method', choices=['centroid', 'bisector'], default='centroid', help='defuzzification method')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    serve(args.files, args.host, args.port, args.unix, args.max_batch_size, args.max_wait_ms / 1000.0, args.engine,
+          args.method)
@@ -1,6 +1,6 @@
-import random
-import os
+import copy
 import sys
+from multiprocessing import Pool
 
 import seaborn as sns
 import matplotlib.pyplot as plt
@@ -8,35 +8,24 @@ from tqdm import tqdm
 from scipy import stats
 
 from modules.fuzzy_control_system import map_variable_types, create_rule_control_system, apply_rules, view_defuzz
+from modules.fuzzy_defuzzifier import defuzzify_centroid_batch
+from modules.fuzzy_inference import consequent_heights, fire_rules_batch
 from modules.fuzzy_load import *
-from modules.fuzzy_membership import create_membership_functions
+from modules.fuzzy_membership import create_membership_functions, trapezoid_membership
 
 sns.set(style='darkgrid', palette="Paired")
 
 
-class HiddenPrints:
-    '''
-    Hides printed values for debugging.
-    '''
-    def __enter__(self):
-        self._original_stdout = sys.stdout
-        sys.stdout = open(os.devnull, 'w')
-
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        sys.stdout.close()
-        sys.stdout = self._original_stdout
-
-
-def sample_fuzzy(file, keep_prob=0.5, n_iter=1000, step_size=100, conseq_var='D'):
+def sample_fuzzy(file, keep_prob=0.5, n_iter=1000, step_size=100, conseq_var='D', seed=None):
     '''
     Randomly samples different variations of fuzzy sets for each variable category with a certain probability.
     
         Args:
-            file(str): the knowledge base file name
+            file(str or KnowledgeBase): the knowledge base file name or compiled knowledge base
             keep_prob(float): probability to resample the original set for each iteration (def: 0.5)
             n_iter(int): number of iterations of the simulation (def: 1000)
             step_size(int): number of steps to skip before displaying the generated fuzzy set (def: 100) conseq_var(str): the name of the consequent variable (ex. 'D')
+            seed(int): seed of the random generator (def: None - unseeded)
 
         Returns:
             fuzzy_result_list(list): the list of simulation results
@@ -50,20 +39,22 @@ def sample_fuzzy(file, keep_prob=0.5, n_iter=1000, step_size=100, conseq_var='D'
     fuzzy_result_list = []
     valid_samples = 0
     fuzzy_sample_list = []
+    kb = as_knowledge_base(file)
+    rng = np.random.RandomState(seed)
 
     for i in tqdm(range(n_iter)):
-        fuzzy_variables = read_variables(file)
+        fuzzy_variables = copy.deepcopy(kb.variables)
         for k, v in fuzzy_variables.items():
             if k == conseq_var:
                 continue
             for k_j, v_j in v.items():
-                rnd = random.random()
+                rnd = rng.random_sample()
                 max_range = max(v_j)
                 if rnd > keep_prob:
-                    gen_a = np.random.randint(0, max_range + 1, 1).item(0)
-                    gen_b = np.random.randint(0, max_range + 1, 1).item(0)
-                    gen_alpha = np.random.randint(0, max_range + 1, 1).item(0)
-                    gen_beta = np.random.randint(0, max_range + 1, 1).item(0)
+                    gen_a = rng.randint(0, max_range + 1, 1).item(0)
+                    gen_b = rng.randint(0, max_range + 1, 1).item(0)
+                    gen_alpha = rng.randint(0, max_range + 1, 1).item(0)
+                    gen_beta = rng.randint(0, max_range + 1, 1).item(0)
                     if gen_b >= fuzzy_variables[k][k_j][0]:
                         fuzzy_variables[k][k_j] = list(fuzzy_variables[k][k_j])
                         fuzzy_variables[k][k_j][1] = gen_b
@@ -82,9 +73,9 @@ def sample_fuzzy(file, keep_prob=0.5, n_iter=1000, step_size=100, conseq_var='D'
                         fuzzy_variables[k][k_j] = tuple(fuzzy_variables[k][k_j])
 
         fuzzy_dict, x_ranges, var_names, _ = create_membership_functions(fuzzy_variables, from_file=False)
-        vmfx_list, fuzzy_measurements = map_variable_types(file, fuzzy_variables, var_names, x_ranges,
+        vmfx_list, fuzzy_measurements = map_variable_types(kb, fuzzy_variables, var_names, x_ranges,
                                                            fuzzy_dict)
-        rcs = create_rule_control_system(file, fuzzy_variables, var_names, vmfx_list)
+        rcs = create_rule_control_system(kb, fuzzy_variables, var_names, vmfx_list)
         try:
             ctr_sys_sim, consequent = apply_rules(rcs, fuzzy_measurements, var_names, vmfx_list)
             if (valid_samples + 1) % step_size == 0:
@@ -99,6 +90,167 @@ def sample_fuzzy(file, keep_prob=0.5, n_iter=1000, step_size=100, conseq_var='D'
     return fuzzy_result_list, valid_samples, fuzzy_sample_list
 
 
+def perturb_parameters(kb, rng, n_samples, keep_prob=0.5, conseq_var='D'):
+    '''
+    Draws the random fuzzy set variations of a whole batch of samples at once.
+    Each term is resampled with probability 1 - keep_prob, using the same acceptance
+    rules as sample_fuzzy, so every generated 4-tuple is a valid trapezoid.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            rng(np.random.Generator): the random generator of the batch
+            n_samples(int): number of samples in the batch
+            keep_prob(float): probability to keep the original set of each term (def: 0.5)
+            conseq_var(str): the name of the consequent variable, which is left unchanged (def: 'D')
+
+        Returns:
+            sample_params(dict): (n_samples, n_terms, 4) matrix of 4-tuples for each perturbed variable
+
+    '''
+
+
+    sample_params = {}
+    for var_name in kb.var_names:
+        if var_name == conseq_var:
+            continue
+        base = kb.term_params[var_name]
+        n_terms = base.shape[0]
+        resample = rng.random((n_samples, n_terms)) > keep_prob
+        high = np.floor(np.max(base, axis=1) + 1).astype(np.int64)
+        generated = rng.integers(0, high[None, :, None], size=(n_samples, n_terms, 4))
+        gen_a, gen_b, gen_alpha, gen_beta = np.moveaxis(generated, -1, 0)
+
+        a, b, alpha, beta = base.T
+        b = np.where(resample & (gen_b >= a), gen_b, b)
+        alpha = np.where(resample & (gen_alpha <= a), gen_alpha, alpha)
+        beta = np.where(resample & (gen_beta <= b), gen_beta, beta)
+        a = np.where(resample & (gen_a <= b), gen_a, a)
+        sample_params[var_name] = np.stack(np.broadcast_arrays(a, b, alpha, beta), axis=-1).astype(np.float64)
+
+    return sample_params
+
+
+def evaluate_perturbed(kb, sample_params, conseq_var, conseq_dict, conseq_range):
+    '''
+    Inferences the knowledge base measurements for a batch of perturbed fuzzy sets.
+    The antecedents are fuzzified analytically with the parameters of each sample.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            sample_params(dict): (n_samples, n_terms, 4) matrix of 4-tuples for each perturbed variable
+            conseq_var(str): the name of the consequent variable
+            conseq_dict(dict): the membership functions of the consequent terms
+            conseq_range(np.array): the range of possible values for the consequent variable
+
+        Returns:
+            results(np.array): (n_samples,) centroid defuzzified values, NaN for invalid samples where no rule fired
+
+    '''
+
+
+    degrees = [None] * len(kb.var_names)
+    for var_name, params in sample_params.items():
+        if var_name in kb.measurements:
+            degrees[kb.var_names.index(var_name)] = trapezoid_membership(kb.measurements[var_name], params)
+
+    heights = consequent_heights(kb, fire_rules_batch(kb, degrees), conseq_var)
+    aggregated_mfx = np.zeros((heights.shape[0], len(conseq_range)))
+    for term_idx, term_name in enumerate(kb.term_names[conseq_var]):
+        np.fmax(aggregated_mfx, np.fmin(heights[:, term_idx, None], conseq_dict[term_name]), out=aggregated_mfx)
+    return defuzzify_centroid_batch(conseq_range, aggregated_mfx)
+
+
+_monte_carlo_state = {}
+
+
+def init_monte_carlo_worker(kb, conseq_var):
+    '''
+    Stores the knowledge base and builds the consequent membership functions once per Monte-Carlo worker.
+
+        Args:
+            kb(KnowledgeBase): the compiled knowledge base
+            conseq_var(str): the name of the consequent variable
+
+    '''
+
+
+    fuzzy_dict, x_ranges, _, _ = create_membership_functions(kb, var_subset=[conseq_var])
+    _monte_carlo_state['kb'] = kb
+    _monte_carlo_state['conseq_var'] = conseq_var
+    _monte_carlo_state['conseq_dict'] = fuzzy_dict[conseq_var]
+    _monte_carlo_state['conseq_range'] = x_ranges[conseq_var]
+
+
+def monte_carlo_block(args):
+    '''
+    Generates and inferences one block of Monte-Carlo samples.
+    The random stream of a block only depends on the seed entropy and the block index.
+
+        Args:
+            args(tuple): the seed entropy, block index, block size and keep probability
+
+        Returns:
+            results(np.array): the defuzzified value of each sample (NaN if invalid)
+            sample_params(dict): the generated 4-tuples of each perturbed variable
+
+    '''
+
+
+    entropy, block_idx, n_samples, keep_prob = args
+    kb = _monte_carlo_state['kb']
+    conseq_var = _monte_carlo_state['conseq_var']
+    rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(block_idx,)))
+    sample_params = perturb_parameters(kb, rng, n_samples, keep_prob, conseq_var)
+    results = evaluate_perturbed(kb, sample_params, conseq_var, _monte_carlo_state['conseq_dict'],
+                                 _monte_carlo_state['conseq_range'])
+    return results, sample_params
+
+
+def monte_carlo_fuzzy(file, keep_prob=0.5, n_iter=100000, conseq_var='D', seed=0, n_jobs=1, block_size=5000):
+    '''
+    Vectorized and parallel counterpart of sample_fuzzy. The perturbations of each block of samples are
+    drawn up front as arrays and inferenced in one pass. Every block has its own seed stream, so the
+    results for a given seed are the same regardless of the number of workers.
+
+        Args:
+            file(str or KnowledgeBase): the knowledge base file name or compiled knowledge base
+            keep_prob(float): probability to keep the original set of each term (def: 0.5)
+            n_iter(int): number of samples of the simulation (def: 100000)
+            conseq_var(str): the name of the consequent variable (def: 'D')
+            seed(int): seed of the simulation, None for a random one (def: 0)
+            n_jobs(int): number of worker processes, None for all cores (def: 1 - run in this process)
+            block_size(int): number of samples generated and inferenced at once (def: 5000)
+
+        Returns:
+            results(np.array): (n_iter,) defuzzified value of each sample, NaN for invalid samples
+            sample_params(dict): (n_iter, n_terms, 4) matrix of sampled 4-tuples for each perturbed variable
+            entropy(int): the seed entropy, which reproduces the simulation when passed as seed
+
+    '''
+
+
+    print('--- Random sampling fuzzy sets ---')
+    kb = as_knowledge_base(file)
+    entropy = np.random.SeedSequence(seed).entropy
+    blocks = [(entropy, block_idx, min(block_size, n_iter - start), keep_prob)
+              for block_idx, start in enumerate(range(0, n_iter, block_size))]
+
+    if n_jobs == 1:
+        init_monte_carlo_worker(kb, conseq_var)
+        block_results = [monte_carlo_block(block) for block in tqdm(blocks)]
+    else:
+        with Pool(n_jobs, initializer=init_monte_carlo_worker, initargs=(kb, conseq_var)) as pool:
+            block_results = list(tqdm(pool.imap(monte_carlo_block, blocks), total=len(blocks)))
+
+    results = np.concatenate([block[0] for block in block_results])
+    sample_params = {}
+    for var_name in block_results[0][1]:
+        sample_params[var_name] = np.concatenate([block[1][var_name] for block in block_results])
+
+    print('Valid samples:', int(np.sum(np.isfinite(results))))
+    return results, sample_params, entropy
+
+
 def plot_simulated_defuzz(fuzzy_result_list, samples):
     '''
     Plots the defuzzified value for each valid iteration.
@@ -128,8 +280,11 @@ def plot_simulated_defuzz(fuzzy_result_list, samples):
     print('Consequent {} statistics:{}'.format(fz_lbl, stats.describe(dfz_values)))
 
 if __name__ == '__main__':
-    with HiddenPrints():
-        # argv[1] = input file name, argv[2] = variable name of the target consequent, argv[3] = step size (def. 200)
-        fuzzy_result_list, samples, fuzzy_sample_list = sample_fuzzy(sys.argv[1], conseq_var=sys.argv[2],
-                                                                     step_size=int(sys.argv[3]))
-    plot_simulated_defuzz(fuzzy_result_list, samples)
+    # argv[1] = input file name, argv[2] = variable name of the target consequent, argv[3] = number of samples (def. 100000)
+    # argv[4] = seed (optional, def. 0), argv[5] = number of worker processes (optional, def. all cores)
+    n_iter = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+    seed = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+    n_jobs = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    results, _, _ = monte_carlo_fuzzy(sys.argv[1], n_iter=n_iter, conseq_var=sys.argv[2], seed=seed, n_jobs=n_jobs)
+    valid_results = results[np.isfinite(results)]
+    plot_simulated_defuzz([{sys.argv[2]: v} for v in valid_results], len(valid_results))
@@ -1,38 +1,69 @@
 import sys
-import os
+from multiprocessing import Pool
 
 import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy import stats
 from tqdm import tqdm
 
-from modules.fuzzy_control_system import map_variable_types, create_rule_control_system, apply_rules
+from modules.fuzzy_control_system import FuzzyControlSystem
 from modules.fuzzy_load import *
 from modules.fuzzy_membership import create_membership_functions
 
+sns.set(style='darkgrid', palette="Paired")
 
-class HiddenPrints:
+
+_sweep_state = {}
+
+
+def init_sweep_worker(file):
     '''
-	Hides printed values for debugging.
+    Builds the knowledge base and its reusable control system once per sweep worker.
+
+        Args:
+            file(str or KnowledgeBase): the knowledge base file name or compiled knowledge base
+
     '''
-    def __enter__(self):
-        self._original_stdout = sys.stdout
-        sys.stdout = open(os.devnull, 'w')
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        sys.stdout.close()
-        sys.stdout = self._original_stdout
+
+    _sweep_state['control_system'] = FuzzyControlSystem(file, pool_size=1)
+
+
+def sweep_chunk(measurement_chunk):
+    '''
+    Inferences a chunk of grid points with the control system of the current worker.
+
+        Args:
+            measurement_chunk(list): the measurement dictionaries of the chunk
+
+        Returns:
+            chunk_results(list): the simulation output of each grid point, None where no rule fired
+
+    '''
+
+
+    chunk_results = []
+    for fuzzy_measurement_dict in measurement_chunk:
+        try:
+            chunk_results.append(_sweep_state['control_system'].compute(fuzzy_measurement_dict))
+        except ValueError:
+            chunk_results.append(None)
+    return chunk_results
 
 
-def sample_defuzz(file, antc_i='HR', antc_j='R', step_size=5):
+def sample_defuzz(file, antc_i='HR', antc_j='R', step_size=5, n_jobs=1, chunk_size=64):
     '''
     Inferences the results for each possible sample from the two anticedents with a fixed step size.
+    The grid is split into chunks that are inferenced by a pool of worker processes, each building
+    the control system once. The results are returned in grid order regardless of the worker count.
     
         Args:
-            file(str): the knowledge base file name
+            file(str or KnowledgeBase): the knowledge base file name or compiled knowledge base
 			antc_i(str): the variable name of the first anticedent (ex. 'HR')
 			antc_j(str): the variable name of the second anticedent (ex. 'R')
 			step_size(int): number of steps to skip before displaying the generated fuzzy set (def: 100)
+			n_jobs(int): number of worker processes, None for all cores (def: 1 - run in this process)
+			chunk_size(int): number of grid points sent to a worker at once (def: 64)
 			
 		Returns:
 			fuzzy_result_list(list): the list of simulation results
@@ -43,24 +74,28 @@ def sample_defuzz(file, antc_i='HR', antc_j='R', step_size=5):
     print('--- Simulating all defuzzified values in the target sets ---')
     fuzzy_sample_list = []
     fuzzy_result_list = []
-    n_samples = 0
-    fuzzy_measurement_dict = {};
 
-    fuzzy_dict, x_ranges, var_names, fuzzy_variables = create_membership_functions(file)
-    for i in tqdm(range(1, len(x_ranges[antc_i]), step_size)):
+    kb = as_knowledge_base(file)
+    _, x_ranges, _, _ = create_membership_functions(kb, var_subset=[antc_i, antc_j])
+    grid = []
+    for i in range(1, len(x_ranges[antc_i]), step_size):
         for j in range(1, len(x_ranges[antc_j]), step_size):
-            fuzzy_measurement_dict[antc_i] = np.float32(x_ranges[antc_i][i])
-            fuzzy_measurement_dict[antc_j] = np.float32(x_ranges[antc_j][j])
-            vmfx_list, _ = map_variable_types(file, fuzzy_variables, var_names, x_ranges, fuzzy_dict)
-            rcs = create_rule_control_system(file, fuzzy_variables, var_names, vmfx_list)
-            try:
-                ctr_sys_sim, consequent = apply_rules(rcs, fuzzy_measurement_dict, var_names, vmfx_list)
-            except ValueError:
-                continue
-            fuzzy_sample_list.append(fuzzy_measurement_dict)
-            fuzzy_measurement_dict = {}
-            fuzzy_result_list.append(ctr_sys_sim.output)
-            n_samples += 1
+            grid.append({antc_i: np.float32(x_ranges[antc_i][i]), antc_j: np.float32(x_ranges[antc_j][j])})
+    chunks = [grid[k:k + chunk_size] for k in range(0, len(grid), chunk_size)]
+
+    if n_jobs == 1:
+        init_sweep_worker(kb)
+        chunk_results = [sweep_chunk(chunk) for chunk in tqdm(chunks)]
+    else:
+        with Pool(n_jobs, initializer=init_sweep_worker, initargs=(kb,)) as pool:
+            chunk_results = list(tqdm(pool.imap(sweep_chunk, chunks), total=len(chunks)))
+
+    for chunk, results in zip(chunks, chunk_results):
+        for fuzzy_measurement_dict, result in zip(chunk, results):
+            if result is not None:
+                fuzzy_sample_list.append(fuzzy_measurement_dict)
+                fuzzy_result_list.append(result)
+    n_samples = len(fuzzy_result_list)
 
     print('Sample size:', n_samples)
     return fuzzy_sample_list, fuzzy_result_list, n_samples
@@ -116,8 +151,9 @@ def plot_simulated_measurements(fuzzy_sample_list, fuzzy_result_list, n_samples,
 
 
 if __name__ == '__main__':
-    with HiddenPrints():
-        # argv[1] = input file name, argv[2] = variable name of anticedent 1, argv[3] = variable name of anticedent 2, argv[4] = step size (def. 10)
-        fuzzy_sample_list, fuzzy_result_list, n_samples = sample_defuzz(sys.argv[1], sys.argv[2], sys.argv[3],
-                                                                        int(sys.argv[4]))
+    # argv[1] = input file name, argv[2] = variable name of anticedent 1, argv[3] = variable name of anticedent 2, argv[4] = step size (def. 10)
+    # argv[5] = number of worker processes (optional, def. all cores)
+    n_jobs = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    fuzzy_sample_list, fuzzy_result_list, n_samples = sample_defuzz(sys.argv[1], sys.argv[2], sys.argv[3],
+                                                                    int(sys.argv[4]), n_jobs)
     plot_simulated_measurements(fuzzy_sample_list, fuzzy_result_list, n_samples, sys.argv[2], sys.argv[3])
@@ -0,0 +1,22 @@
+import sys
+
+from modules.fuzzy_load import load_knowledge_base
+from modules.fuzzy_stream import stream_inference
+
+if __name__ == '__main__':
+    # argv[1] = input file name, argv[2] = measurements file (.csv or .jsonl, '-' for a CSV on stdin),
+    # argv[3] = output file name (optional, def. stdout), argv[4] = chunk size (optional, def. 10000)
+    kb = load_knowledge_base(sys.argv[1])
+    fmt = 'jsonl' if sys.argv[2].endswith(('.jsonl', '.json')) else 'csv'
+    chunk_size = int(sys.argv[4]) if len(sys.argv) > 4 else 10000
+
+    input_fp = sys.stdin if sys.argv[2] == '-' else open(sys.argv[2], newline='')
+    output_fp = open(sys.argv[3], 'w', newline='') if len(sys.argv) > 3 and sys.argv[3] != '-' else sys.stdout
+    try:
+        n_rows = stream_inference(kb, input_fp, output_fp, fmt, chunk_size)
+    finally:
+        if input_fp is not sys.stdin:
+            input_fp.close()
+        if output_fp is not sys.stdout:
+            output_fp.close()
+    print('Inferenced {} measurement rows'.format(n_rows), file=sys.stderr)
@@ -0,0 +1,36 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from modules.fuzzy_memo import MemoizedInference
+
+KB_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tip.fuzzy')
+
+
+def test_missing_file_keeps_the_loaded_knowledge_base(tmp_path):
+    file = str(tmp_path / 'tip.fuzzy')
+    shutil.copy(KB_FILE, file)
+    memo = MemoizedInference(file, quantum=0.5, check_interval=0.0)
+    expected = memo.evaluate({'food_quality': 3.0, 'service': 7.0})
+    kb = memo.kb
+
+    os.remove(file)
+    assert memo.evaluate({'food_quality': 3.0, 'service': 7.0}) == expected
+    assert memo.kb is kb
+    assert memo.stats()['outputs']['hits'] == 1
+
+    # once the file is back with a different content, it is reloaded
+    with open(KB_FILE) as fp:
+        text = fp.read()
+    with open(file, 'w') as fp:
+        fp.write(text.replace('Rule 1:', '\nRule 1:', 1))
+    assert memo.refresh(force=True)
+    assert memo.kb is not kb
+    np.testing.assert_allclose(memo.evaluate({'food_quality': 3.0, 'service': 7.0})['tip'], expected['tip'])
+
+
+def test_missing_file_on_first_load_raises(tmp_path):
+    with pytest.raises(OSError):
+        MemoizedInference(str(tmp_path / 'missing.fuzzy'))